@@ -1,48 +1,422 @@
-from datetime import datetime, timedelta
+import csv
+import os
+import re
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, date as Date
 from decimal import Decimal
+from typing import Dict, Iterable, Optional, Set, Tuple
 
 import requests
 import simplejson as json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from engine.store import RateStore, is_sqlite_file
 from engine.utils import ExchangeRateNotFound
 
+API_URL = "https://api.nbp.pl/api"
+LOOKBACK_DAYS = 10  # how many days before transaction date are checked for published exchange rate
+MAX_RANGE_DAYS = 93  # NBP API limit for date range queries
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+NEGATIVE_TTL = 24 * 3600  # [s] how long failed lookup is remembered
+ARCHIVE_COLUMN = re.compile(r"^(\d+)([A-Z]{3})$")  # e.g. 100HUF
+
+
+def _easter(year: int):
+    # anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return Date(year, month, day + 1)
+
+
+def polish_holidays(year: int):
+    """Polish public holidays (dni ustawowo wolne od pracy) - NBP doesn't publish exchange rates on these days."""
+    easter = _easter(year)
+    holidays = {Date(year, 1, 1), Date(year, 5, 1), Date(year, 5, 3), Date(year, 8, 15), Date(year, 11, 1), Date(year, 11, 11),
+                Date(year, 12, 25), Date(year, 12, 26),
+                easter, easter + timedelta(days=1), easter + timedelta(days=49), easter + timedelta(days=60)}
+    if year >= 2011:
+        holidays.add(Date(year, 1, 6))
+    if year >= 2025:
+        holidays.add(Date(year, 12, 24))
+    if year == 2018:
+        holidays.add(Date(2018, 11, 12))
+    return holidays
+
+
+def read_archive(file: str):
+    """
+    Stream NBP yearly table A archive CSV (archiwum_tab_a_YYYY.csv): yields (publication date, {currency: rate}).
+    Header row "data;1USD;100HUF;..." gives currency and units of each column, it may repeat when currency set changes.
+    """
+    with open(file, newline="", encoding="cp1250") as csv_file:
+        columns = {}
+        for row in csv.reader(csv_file, delimiter=";"):
+            if not row:
+                continue
+            if row[0] == "data":
+                columns = {i: (match.group(2), int(match.group(1))) for i, match in enumerate(ARCHIVE_COLUMN.match(c) for c in row) if match}
+                continue
+            if not re.fullmatch(r"\d{8}", row[0]):  # skip currency names, iso codes, units rows
+                continue
+            day = Date(int(row[0][:4]), int(row[0][4:6]), int(row[0][6:]))
+            yield day, {currency: round(Decimal(row[i].replace(",", ".")) / units, 4) for i, (currency, units) in columns.items() if i < len(row) and row[i]}
+
+
+def _date_ranges(dates: Iterable[Date]):
+    """Group dates into as few NBP date range queries as possible. Each range covers at most MAX_RANGE_DAYS days."""
+    start = end = None
+    for date in sorted(dates):
+        if start and (date - start).days < MAX_RANGE_DAYS:
+            end = date
+            continue
+        if start:
+            yield start, end
+        start = end = date
+    if start:
+        yield start, end
+
+
+class PublicationCalendar:
+    """
+    Index of NBP table A publication days. Built locally from Polish business days (weekdays without public holidays),
+    corrected by days verified against NBP API. Lookups use bisect on lazily built, sorted per year lists.
+    """
+
+    def __init__(self):
+        self.published = set()  # publication days not following the rule
+        self.unpublished = set()  # business days without published table
+        self._index = {}  # {year: [publication days]}
+
+    @staticmethod
+    def _is_business_day(day: Date):
+        return day.weekday() < 5 and day not in polish_holidays(day.year)
+
+    def days(self, year: int):
+        """Sorted publication days of year."""
+        days = self._index.get(year, None)
+        if days is None:
+            holidays = polish_holidays(year)
+            day, days = Date(year, 1, 1), []
+            while day.year == year:
+                if day in self.published or (day.weekday() < 5 and day not in holidays and day not in self.unpublished):
+                    days.append(day)
+                day += timedelta(days=1)
+            self._index[year] = days
+        return days
+
+    def is_publication_day(self, day: Date):
+        days = self.days(day.year)
+        i = bisect_left(days, day)
+        return i < len(days) and days[i] == day
+
+    def day_before(self, date: Date):
+        """Last publication day strictly before date."""
+        year = date.year
+        days = self.days(year)
+        i = bisect_left(days, date)
+        while not i:  # no publication day earlier in this year
+            year -= 1
+            days = self.days(year)
+            i = len(days)
+        return days[i - 1]
+
+    def mark(self, day: Date, published: bool):
+        """Record publication status of day verified against NBP API. Returns True if calendar has changed."""
+        if self.is_publication_day(day) == published or (not published and day >= Date.today()):  # today's table may be not published yet
+            return False
+        rule = self._is_business_day(day)
+        self.published.discard(day)
+        self.unpublished.discard(day)
+        if published and not rule:
+            self.published.add(day)
+        if not published and rule:
+            self.unpublished.add(day)
+        self._index.pop(day.year, None)
+        return True
+
+    def corrections(self, day: Date):
+        """Stored correction of day: True - published, False - not published, None - following the rule."""
+        return True if day in self.published else False if day in self.unpublished else None
+
+    def load(self, published: Set[Date], unpublished: Set[Date]):
+        self.published, self.unpublished = set(published), set(unpublished)
+        self._index = {}
+
+
+class RateTable(dict):
+    """Resolved D-1 rates {(currency, transaction date): rate}, picklable stand-in for NBP in worker processes."""
+
+    def get_nbp_day_before(self, currency: str, date: datetime):
+        rate = self.get((currency, date.date()), None)
+        if rate is None:
+            raise ExchangeRateNotFound(f"No resolved {currency} rate for {date.date()}.")
+        return rate
+
 
 class NBP:
-    cache = {}
+    """
+    NBP table A exchange rates with two level cache: transaction date -> publication date (resolved from calendar) -> rates,
+    so all transaction dates resolving to the same publication day share one fetch and one cache entry.
+    Rates are persisted in SQLite RateStore and read from it lazily, per publication day. Every fetched response is committed
+    at once, so an interrupted run resumes from already fetched rates.
+    """
 
-    def __init__(self, cache_file: str = ".cache"):
+    def __init__(self, cache_file: str = ".cache", api_url: str = API_URL, tables: bool = True, workers: int = 4, retries: int = 5,
+                 backoff: float = 0.5, timeout: float = 30, negative_ttl: float = NEGATIVE_TTL):
+        """
+        :param tables: fetch whole table A (all currencies) per publication day instead of single currency rates
+        :param workers: max number of concurrent requests (and pooled keep-alive connections) to NBP API
+        :param retries: number of retries on connection errors and 429, 5xx responses
+        :param backoff: exponential backoff factor [s] between retries
+        :param negative_ttl: time [s] failed lookup is remembered in cache, before trying NBP API again
+        """
         self.cache_file = cache_file
+        self.api_url = api_url
+        self.table_mode = tables
+        self.workers = workers
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(["GET"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.calendar = PublicationCalendar()
+        self.resolved = {}  # {transaction date: publication date}
+        self.published = {}  # {publication date: {currency: rate}} read from store or fetched
+        self.tables = set()  # publication dates with complete table A in self.published
+        self.failures = {}  # {(currency, transaction date): reason} of failed lookups in this run
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            legacy = os.path.exists(self.cache_file) and not is_sqlite_file(self.cache_file)
+            if legacy:
+                os.replace(self.cache_file, f"{self.cache_file}.json")
+            self._store = RateStore(self.cache_file)
+            if legacy:
+                self._migrate(f"{self.cache_file}.json")
+            self.calendar.load(*self._store.calendar())
+        return self._store
+
+    def _migrate(self, file: str):
+        """Import JSON cache of earlier versions: {"transaction date currency": rate}."""
+        with open(file, "rb") as f:
+            data = json.load(f)
+        for key, rate in data.items():
+            date, currency = key.split(" ")
+            self._store.upsert(self.calendar.day_before(Date.fromisoformat(date)), {currency: round(Decimal(rate), 4)})
+        self._store.commit()
 
     def save_cache(self):
-        try:
-            with open(self.cache_file, "w") as f:
-                json.dump(self.cache, f)
-        except OSError:  # pragma: no cover
-            pass
+        self.store.commit()
 
     def load_cache(self):
-        try:
-            with open(self.cache_file, "rb") as f:
-                self.cache = {k: round(Decimal(v), 4) for k, v in json.load(f).items()}
-        except OSError:  # pragma: no cover
-            pass
+        self.resolved, self.published, self.tables, self.failures = {}, {}, set(), {}
+        self.calendar.load(*self.store.calendar())
 
-    def get_nbp_day_before(self, currency: str, date: datetime):
+    def close(self):
+        self.session.close()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def _exchange_date(self, date: Date):
+        """Publication date of D-1 exchange rate for transaction date."""
+        exchange_date = self.resolved.get(date, None)
+        if exchange_date is None:
+            exchange_date = self.resolved[date] = self.calendar.day_before(date)
+        return exchange_date
+
+    def _mark(self, start: Date, end: Date, published: Iterable[Date]):
+        """Update calendar with publication days verified by table A date range query."""
+        changed = []
+        for i in range(((end or start) - start).days + 1):
+            day = start + timedelta(days=i)
+            if self.calendar.mark(day, day in published):
+                changed.append(day)
+        if changed:
+            self.resolved = {}
+            for day in changed:
+                self.store.mark([day], self.calendar.corrections(day))
+
+    def _day(self, day: Date):
+        """Rates published on day from memory or store."""
+        rates = self.published.get(day, None)
+        if rates is None:
+            rates, complete = self.store.day(day)
+            self.published[day] = rates
+            if complete:
+                self.tables.add(day)
+        return rates
+
+    def _get(self, currency: Optional[str], start: Date, end: Date = None):
+        """Single currency rates or, when currency is None, table A published between start and end."""
+        path = f"{self.api_url}/exchangerates/rates/a/{currency}" if currency else f"{self.api_url}/exchangerates/tables/a"
+        url = f"{path}/{start}/{end}" if end else f"{path}/{start}"
+        return self.session.get(f"{url}?format=json", timeout=self.timeout)
+
+    def _store_response(self, currency: Optional[str], start: Date, end: Optional[Date], response: requests.Response):
+        """Store rates from _get response in self.published and rate store. Errors other than 404 (no data) are raised, not taken as days without rates."""
+        if response.status_code not in (200, 404):
+            response.raise_for_status()
+        if currency:
+            if response.status_code != 200:  # either no table or currency not quoted in table A
+                return
+            rates = {Date.fromisoformat(rate["effectiveDate"]): round(Decimal(rate["mid"]), 4) for rate in response.json()["rates"]}
+            for day, rate in rates.items():
+                self._day(day)[currency] = rate
+                self.store.upsert(day, {currency: rate})
+            # no calendar update, missing day of one currency series (e.g. no longer quoted currency) doesn't mean there was no table
+        else:
+            tables = response.json() if response.status_code == 200 else []
+            for table in tables:
+                day = Date.fromisoformat(table["effectiveDate"])
+                self.published[day] = {rate["code"]: round(Decimal(rate["mid"]), 4) for rate in table["rates"]}
+                self.tables.add(day)
+                self.store.upsert(day, self.published[day], True)
+            self._mark(start, end, {Date.fromisoformat(table["effectiveDate"]) for table in tables})
+        self.store.commit()  # checkpoint, interrupted run loses at most requests in flight
+
+    def _fetch(self, currency: str, start: Date, end: Date = None):
+        currency = None if self.table_mode else currency
+        self._store_response(currency, start, end, self._get(currency, start, end))
+
+    def _is_cached(self, currency: str, exchange_date: Date):
+        return currency in self._day(exchange_date) or exchange_date in self.tables
+
+    def _fetch_days(self, days: Dict[str, Set[Date]]):
+        """
+        Fetch rates of currencies published on given days {currency: {publication date}}, if not cached yet.
+        Uses date range queries (MAX_RANGE_DAYS days per request), in tables mode all currencies come with the same request,
+        otherwise there are separate requests per currency. Requests run concurrently, responses are stored as they come.
+        """
+        missing = {}
+        for currency, exchange_dates in days.items():
+            for exchange_date in exchange_dates:
+                if not self._is_cached(currency, exchange_date):
+                    missing.setdefault(None if self.table_mode else currency, set()).add(exchange_date)
+
+        queries = [(currency, start, end) for currency, exchange_dates in missing.items() for start, end in _date_ranges(exchange_dates)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._get, *query): query for query in queries}
+            try:
+                for future in as_completed(futures):
+                    self._store_response(*futures[future], future.result())
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def rate_table(self, dates: Iterable[Tuple[str, datetime]]) -> RateTable:
+        """Resolve rates of (currency, transaction time) pairs up front, so they can be used without access to NBP."""
+        table = RateTable()
+        for currency, time in dates:
+            key = (currency, time.date())
+            if key not in table:
+                table[key] = self.get_nbp_day_before(currency, time)
+        return table
+
+    def prefetch(self, dates: Iterable[Tuple[str, datetime]]):
+        """
+        Fetch D-1 exchange rates for all (currency, date) pairs, for publication days resolved from calendar, instead of one request per date.
+        Dates without published rate are resolved one by one, failures are collected in self.failures.
+        """
+        days, pairs = {}, set()
+        for currency, time in dates:
+            if currency:
+                days.setdefault(currency, set()).add(self._exchange_date(time.date()))
+            pairs.add((currency, time.date()))
+        self._fetch_days(days)
+
+        for currency, date in pairs:  # resolve dates without published rate, record failures
+            try:
+                self.get_nbp_day_before(currency, datetime(date.year, date.month, date.day))
+            except ExchangeRateNotFound:
+                pass
+
+    def prefetch_year(self, year: int, currencies: Iterable[str]):
+        """
+        Fetch rates of currencies for all publication days of year (until yesterday).
+        Returns coverage: [[year, currency, publication days, cached, missing],...].
+        """
+        currencies = list(currencies)
+        days = [d for d in self.calendar.days(year) if d < Date.today()]
+        self._fetch_days({currency: set(days) for currency in currencies})
+
+        days = [d for d in self.calendar.days(year) if d < Date.today()]  # calendar may be corrected by fetched data
+        coverage = []
+        for currency in currencies:
+            cached = sum(1 for d in days if currency in self._day(d))
+            coverage.append([year, currency, len(days), cached, len(days) - cached])
+        return coverage
+
+    def import_archive(self, file: str):
+        """
+        Bulk load NBP yearly table A archive CSV into rate store in single transaction, marking publication days of covered period.
+        Returns (number of days, number of currencies).
+        """
+        days, currencies = set(), set()
+        for day, rates in read_archive(file):
+            self.published[day] = rates
+            self.tables.add(day)
+            self.store.upsert(day, rates, True)
+            days.add(day)
+            currencies.update(rates)
+        if days:
+            self._mark(min(days), max(days), days)
+        self.store.commit()
+        return len(days), len(currencies)
+
+    def _not_found(self, currency: Optional[str], date: Date, reason: str):
+        self.failures[(currency, date)] = reason
+        if currency:  # missing currency is not NBP failure, nothing to remember in store
+            self.store.add_miss(currency, date, reason, self.negative_ttl)
+            self.store.commit()
+        raise ExchangeRateNotFound(reason)
+
+    def failure_report(self):
+        """Failed lookups of this run aggregated by currency."""
+        by_currency = {}
+        for (currency, date), reason in sorted(self.failures.items(), key=lambda failure: (failure[0][0] or "", failure[0][1])):
+            by_currency.setdefault(currency, []).append((date, reason))
+        lines = [f"NBP exchange rate not found for {len(self.failures)} transaction dates:"]
+        for currency, failures in by_currency.items():
+            lines.append(f"  {currency or 'no currency'}: {len(failures)} dates from {failures[0][0]} to {failures[-1][0]} - {failures[0][1]}")
+        return "\n".join(lines)
+
+    def get_nbp_day_before(self, currency: Optional[str], date: datetime):
         date = date.date()
-        exchange_date = date - timedelta(days=1)
-
-        hash = f"{date} {currency}"
-
-        hit = self.cache.get(hash, None)
-        if hit:
-            return hit
-        count = 10
-        while count:
-            response = requests.get(r"https://api.nbp.pl/api/exchangerates/rates/a/%s/%s?format=json" % (currency, exchange_date))
-            if response.status_code == 200:
-                data = round(Decimal(response.json()["rates"][0]["mid"]), 4)
-                self.cache[hash] = data
-                return data
-            exchange_date = exchange_date - timedelta(days=1)
-            count -= 1
-        raise ExchangeRateNotFound
+        failure = self.failures.get((currency, date), None)
+        if failure:
+            raise ExchangeRateNotFound(failure)
+        if not currency:
+            self._not_found(currency, date, f"No currency of transaction on {date}, its price row may be missing.")
+        exchange_date = self._exchange_date(date)
+        rate = self._day(exchange_date).get(currency, None)
+        if rate is not None:
+            return rate
+        failure = self.store.miss(currency, date)
+        if failure:
+            self.failures[(currency, date)] = failure
+            raise ExchangeRateNotFound(failure)
+
+        while (date - exchange_date).days <= LOOKBACK_DAYS:
+            if not self._is_cached(currency, exchange_date):
+                self._fetch(currency, exchange_date)
+            rate = self._day(exchange_date).get(currency, None)
+            if rate is not None:
+                return rate
+            if exchange_date in self.tables:
+                self._not_found(currency, date, f"{currency} is not quoted in NBP table A.")
+            exchange_date = self.calendar.day_before(exchange_date)
+        self._not_found(currency, date, f"No {currency} rate published by NBP within {LOOKBACK_DAYS} days before {date}.")
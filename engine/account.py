@@ -1,16 +1,28 @@
+import codecs
 import csv
+import heapq
+import mmap
 import os
+import sys
 from abc import ABCMeta, abstractmethod
+from array import array
+from itertools import chain
 from typing import List
 
 from engine.NBP import NBP
-from engine.utils import ParseError
+from engine.journal import Journal, JournalCache
+from engine.utils import ExchangeRateNotFound, ParseError
 
 
 class AccountBase(metaclass=ABCMeta):
-    def __init__(self, warning_handler=None):
+    PARSER_VERSION = 3  # bump on every change of parsing result, invalidates journal cache
+    _parsed = ("transaction_log",)  # attributes filled by parsing, stored in journal cache
+    _parser_options = ()  # attributes changing parsing result
+
+    def __init__(self, warning_handler=None, journal_cache: JournalCache = None):
         self.cash_flows = {}
-        self.transaction_log = {}
+        self.transaction_log = Journal()
+        self.journal_cache = journal_cache
 
         def _no_warn(e):
             pass
@@ -18,44 +30,189 @@ class AccountBase(metaclass=ABCMeta):
         self._warning_handler = warning_handler if warning_handler else _no_warn
 
     @staticmethod
-    def load_csv_file(file, encoding, delimiter):
+    def read_csv_file(file, encoding, delimiter):
+        """Rows of CSV file, read lazily."""
         with open(file, newline='', encoding=encoding) as csv_file:
             reader = csv.reader(csv_file, delimiter=delimiter)
             next(reader, None)  # skip header
-            return [row for row in reader]
+            yield from reader
+
+    @staticmethod
+    def load_csv_file(file, encoding, delimiter):
+        return list(AccountBase.read_csv_file(file, encoding, delimiter))
+
+    @staticmethod
+    def _is_ordered(rows, key):
+        previous = None
+        for row in rows:
+            current = key(row)
+            if previous is not None and current < previous:
+                return False
+            previous = current
+        return True
+
+    @staticmethod
+    def _sorted_rows(file, encoding, delimiter, sort_by=None):
+        # file already in order is streamed row by row (key only pass checks it), otherwise it has to be sorted in memory
+        if sort_by and not AccountBase._is_ordered(AccountBase.read_csv_file(file, encoding, delimiter), sort_by):
+            rows = AccountBase.load_csv_file(file, encoding, delimiter)
+            rows.sort(key=sort_by)
+            return rows
+        return AccountBase.read_csv_file(file, encoding, delimiter)
 
     @staticmethod
-    def _load_transaction_logs(directory, single_file_loader):
-        for entry in os.scandir(directory):
-            if (entry.path.endswith(".csv") or entry.path.endswith(".txt")) and entry.is_file():
-                single_file_loader(entry.path)
+    def _transaction_log_files(directory):
+        return sorted(entry.path for entry in os.scandir(directory) if (entry.path.endswith(".csv") or entry.path.endswith(".txt")) and entry.is_file())
 
     def _load_transaction_log(self, file, encoding, delimiter, sort_by=None):
-        rows = AccountBase.load_csv_file(file, encoding, delimiter)
-        self._parse_transaction_log(rows, sort_by)
+        self._cached_parse(file, [file], lambda: self._parse_rows(AccountBase._sorted_rows(file, encoding, delimiter, sort_by)))
+
+    @staticmethod
+    def _line_chunks(file, encoding, count, quote='"'):
+        """
+        Codec and [(begin, end),...] byte ranges splitting file into about count parts on line boundaries, so parts can be decoded independently.
+        Byte order mark is left out of parts. Quotes are counted from file start, line end inside quoted field is not a boundary.
+        """
+        size = os.path.getsize(file)
+        with open(file, "rb") as f:
+            head = f.read(2)
+        codec, start = codecs.lookup(encoding).name, 0
+        if codec == "utf-16":
+            codec = "utf-16-be" if head == codecs.BOM_UTF16_BE else "utf-16-le" if head == codecs.BOM_UTF16_LE else f"utf-16-{sys.byteorder[0]}e"
+            start = 2 if head in (codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE) else 0
+        if size <= start:
+            return codec, [(start, size)]
+        newline, quote = "\n".encode(codec), quote.encode(codec)
+        unit = len(newline)
+        offsets = [start]
+        with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position, quotes = start, 0  # quotes before position
+            for i in range(1, count):
+                target = start + (size - start) * i // count
+                target -= (target - start) % unit
+                if target <= position:
+                    continue
+                quotes += AccountBase._count(data[position:target], quote, unit)
+                position = target
+                while True:  # first line end with even number of quotes before it
+                    found = AccountBase._find(data, newline, position, start, unit)
+                    if found < 0:
+                        break
+                    quotes += AccountBase._count(data[position:found], quote, unit)
+                    position = found + unit
+                    if quotes % 2 == 0:
+                        break
+                if found < 0 or position >= size:
+                    break
+                offsets.append(position)
+        offsets.append(size)
+        return codec, list(zip(offsets, offsets[1:]))
+
+    @staticmethod
+    def _find(data, separator, position, start, unit):
+        # offset of first separator aligned to code unit at or after position
+        found = data.find(separator, position)
+        while found >= 0 and (found - start) % unit:
+            found = data.find(separator, found + 1)
+        return found
+
+    @staticmethod
+    def _count(data, separator, unit):
+        # number of separators aligned to code unit in data starting at code unit boundary
+        if unit == 1:
+            return data.count(separator)
+        return array({2: "H", 4: "I"}[unit], data).count(int.from_bytes(separator, sys.byteorder))
+
+    def _load_transaction_logs(self, directory, encoding, delimiter, sort_by=None, unique_by=tuple):
+        # each file is sorted on its own, sorted files are merged into one ordered stream (heap based, O(N log k) for k files)
+        # rows repeated in overlapping files are parsed once, unique_by gives row identity
+        files = self._transaction_log_files(directory)
+
+        def _parse():
+            logs = [AccountBase._sorted_rows(file, encoding, delimiter, sort_by) for file in files]
+            rows = heapq.merge(*logs, key=sort_by) if sort_by else chain.from_iterable(logs)
+            self._parse_rows(self._unique_rows(rows, unique_by))
+
+        self._cached_parse(directory, files, _parse)
+
+    def _cached_parse(self, source, files, parse):
+        # parsing result of empty account is restored from journal cache snapshot, warnings are replayed
+        if not self.journal_cache or any(getattr(self, name) for name in self._parsed):
+            return parse()
+        key = JournalCache.key(files, type(self).__name__, self.PARSER_VERSION, *(getattr(self, name) for name in self._parser_options))
+        snapshot = self.journal_cache.load(source, key)
+        if snapshot:
+            state, warnings = snapshot
+            for name, value in state.items():
+                setattr(self, name, value)
+            for warning in warnings:
+                self._warning_handler(warning)
+            return
+
+        warnings = []
+        warning_handler = self._warning_handler
+
+        def _warn(e):
+            warnings.append(e)
+            warning_handler(e)
+
+        self._warning_handler = _warn
+        try:
+            parse()
+        finally:
+            self._warning_handler = warning_handler
+        self.journal_cache.save(source, key, ({name: getattr(self, name) for name in self._parsed}, warnings))
+
+    def _unique_rows(self, rows, unique_by):
+        seen = set()
+        duplicates = 0
+        for row in rows:
+            key = unique_by(row)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            yield row
+        if duplicates:
+            self._warning_handler(f"Skipped {duplicates} duplicate transactions found in overlapping transaction logs.")
 
     def _parse_transaction_log(self, rows, sort_by=None):
         if sort_by:
             rows.sort(key=sort_by)
+        self._parse_rows(rows)
+
+    def _parse_rows(self, rows, parse=None):
+        parse = parse or self._parse
         for row in rows:
             try:
-                self._parse(row)
+                parse(row)
             except ParseError as e:
                 self._warning_handler(e)
 
     def init_cash_flow(self, nbp=NBP()):
         nbp.load_cache()
-
-        self._load_cash_flow(nbp)
-
-        nbp.save_cache()
+        try:
+            nbp.prefetch(self._exchange_rate_dates())
+            if nbp.failures:
+                raise ExchangeRateNotFound(nbp.failure_report())
+            self._load_cash_flow(nbp)
+        finally:
+            nbp.save_cache()
+
+    def _exchange_rate_dates(self):
+        # (currency, time) of every transaction, so all exchange rates can be fetched before cash flow calculation
+        for transactions in self.transaction_log.values():
+            for t in transactions:
+                if t.currency:
+                    yield t.currency, t.time
 
     @abstractmethod
     def load_transaction_log(self, file):  # pragma: no cover
         pass
 
-    def load_transaction_logs(self, directory):
-        self._load_transaction_logs(directory, self.load_transaction_log)
+    @abstractmethod
+    def load_transaction_logs(self, directory):  # pragma: no cover
+        pass
 
     @abstractmethod
     def _parse(self, row: List[str]):  # pragma: no cover
@@ -64,4 +221,3 @@ class AccountBase(metaclass=ABCMeta):
     @abstractmethod
     def _load_cash_flow(self, nbp):  # pragma: no cover
         pass
-
@@ -1,8 +1,23 @@
+import copy
+import csv
+import hashlib
+import heapq
+import io
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from decimal import Decimal
+from itertools import repeat
+from operator import itemgetter
 from typing import List
 
+from engine.NBP import NBP
 from engine.account import AccountBase
+from engine.fifo import Lot, YearEndSnapshot, match_fifo
+from engine.journal import JournalCache
+from engine.report import CashFlowTotals
+from engine.results import ResultStore
 from engine.transaction import TransactionSide, TradeTransaction, DividendTransaction, CashFlowItem, CashFlowItemType
 from engine.utils import ParseError
 
@@ -19,6 +34,9 @@ class Column:
     COMMENT = 10
 
 
+SUPPORTED_OP_TYPES = ("TRADE", "COMMISSION", "DIVIDEND", "TAX")
+
+
 class ExanteAccount(AccountBase):
     """
     - Load transaction log into an array from CSV file and sort it ascending by transaction id.
@@ -32,40 +50,67 @@ class ExanteAccount(AccountBase):
 
     """
 
-    def __init__(self, warning_handler=None):
-        super().__init__(warning_handler)
+    CASH_FLOW_VERSION = 2  # bump on every change of cash flow calculation, invalidates stored results
+
+    def __init__(self, warning_handler=None, jobs: int = 1, journal_cache: JournalCache = None, year_end: YearEndSnapshot = None,
+                 results: ResultStore = None):
+        """
+        :param jobs: number of worker processes parsing transaction log file and calculating cash flow of symbols in parallel
+        :param journal_cache: cache of parsed transaction logs
+        :param year_end: FIFO state to start from, only transactions after its year are calculated
+        :param results: store of symbol cash flows, only symbols with changed transactions are calculated
+        """
+        super().__init__(warning_handler, journal_cache)
+        self.jobs = jobs
+        self.year_end = year_end
+        self.results = results
+        self._report_totals = None  # (cash flows, totals)
+        self._fingerprints = None  # {symbol: fingerprint} during init_cash_flow
 
     def load_transaction_log(self, file):
-        super()._load_transaction_log(file, "utf=16", '\t', lambda i: i[Column.ID])
+        if self.jobs > 1:
+            self._load_transaction_log_parallel(file, "utf=16", '\t')
+        else:
+            super()._load_transaction_log(file, "utf=16", '\t', lambda i: i[Column.ID])
+
+    def _load_transaction_log_parallel(self, file, encoding, delimiter):
+        """
+        Parse transaction log file in jobs worker processes. File is split on line boundaries, workers decode their parts and turn rows
+        into records with stateless _parse_record, parts are merged in transaction id order and records are attached serially.
+        """
+        def _parse():
+            codec, chunks = self._line_chunks(file, encoding, self.jobs * 4)
+            with ProcessPoolExecutor(self.jobs) as executor:
+                parsed = list(executor.map(_parse_chunk, repeat(file), repeat(codec), chunks, [i == 0 for i in range(len(chunks))], repeat(delimiter)))
+            self._parse_rows(heapq.merge(*parsed, key=itemgetter(0)), self._attach)
+
+        self._cached_parse(file, [file], _parse)
+
+    def load_transaction_logs(self, directory):
+        super()._load_transaction_logs(directory, "utf=16", '\t', lambda i: i[Column.ID], lambda i: i[Column.ID])
 
     def _parse(self, row: List[str]):
-        op_type = row[Column.OP_TYPE]
-        supported_op_types = ("TRADE", "COMMISSION", "DIVIDEND", "TAX")
+        record = _parse_record(row)
+        if record is not None:
+            self._attach(record)
 
-        if op_type == "FUNDING/WITHDRAWAL":
-            return
+    def _attach(self, record: tuple):
+        # stateful part of parsing: rows of price, commission and tax are attached to transaction parsed before
+        _, op_type, time, symbol, isin, asset, amount = record
 
-        if op_type not in supported_op_types:
+        if op_type not in SUPPORTED_OP_TYPES:
             raise ParseError(f"Unsupported transaction type {op_type}.")
 
-        time = datetime.fromisoformat(row[Column.TIME])
-        isin = row[Column.ISIN]
-        asset = row[Column.ASSET]
-        symbol = row[Column.SYMBOL]
-
         # count, side for TradeTransaction
         if op_type == "TRADE" and isin != "None" and asset == symbol:
-            count = int(row[Column.SUM])
-            side = TransactionSide.BUY if count > 0 else TransactionSide.SELL
-            count = abs(count)
-            log_item = TradeTransaction(time=time, side=side, count=count, symbol=symbol)
-            self.transaction_log[symbol] = [log_item] if symbol not in self.transaction_log.keys() else self.transaction_log[symbol] + [log_item]
+            side = TransactionSide.BUY if amount > 0 else TransactionSide.SELL
+            log_item = TradeTransaction(time=time, side=side, count=abs(amount), symbol=symbol)
+            self.transaction_log.append(log_item)
             return
 
         if op_type == "DIVIDEND":
-            value = Decimal(row[Column.SUM])
-            log_item = DividendTransaction(time=time, value=value, symbol=symbol, currency=asset)
-            self.transaction_log[symbol] = [log_item] if symbol not in self.transaction_log.keys() else self.transaction_log[symbol] + [log_item]
+            log_item = DividendTransaction(time=time, value=amount, symbol=symbol, currency=asset)
+            self.transaction_log.append(log_item)
             return
 
         # another row of transaction object
@@ -74,80 +119,171 @@ class ExanteAccount(AccountBase):
         if isin == "None" and last_log_item.time == time and last_log_item.symbol == symbol:
             # price, currency for last TradeTransaction
             if op_type == "TRADE":
-                last_log_item.price = abs(Decimal(row[Column.SUM]) / last_log_item.count)
+                last_log_item.price = abs(amount / last_log_item.count)
                 last_log_item.currency = asset
                 return
             # commission for last TradeTransaction
             if op_type == "COMMISSION":
-                last_log_item.commission = abs(Decimal(row[Column.SUM]))
+                last_log_item.commission = abs(amount)
                 return
         # tax for DividendTransaction
         if op_type == "TAX":
-            last_log_item.tax = abs(Decimal(row[Column.SUM]))
+            last_log_item.tax = abs(amount)
             return
 
+    def init_cash_flow(self, nbp=NBP()):
+        # fingerprints are computed once, both prefetch and calculation look up stored cash flows by them
+        self._fingerprints = {symbol: self._fingerprint(symbol) for symbol in self.transaction_log} if self.results else None
+        try:
+            super().init_cash_flow(nbp)
+        finally:
+            self._fingerprints = None
+
     def _load_cash_flow(self, nbp):
         #
         # self.cash_flows = {year: {'symbol': [cash_flow_item,...],...},...}
         #
 
-        for symbol, tr in self.transaction_log.items():
-            sell = [t for t in tr if t.side == TransactionSide.SELL]
-            buy = [t for t in tr if t.side == TransactionSide.BUY]
-            dividend = [t for t in tr if t.side == TransactionSide.DIVIDEND]
-
-            if not buy and not dividend:
+        symbols = list(self.transaction_log)
+        fingerprints, stored = {}, {}
+        if self.results:
+            for symbol in symbols:
+                fingerprints[symbol] = self._symbol_fingerprint(symbol)
+                try:
+                    stored[symbol] = self.results.get(symbol, fingerprints[symbol])
+                except KeyError:
+                    pass
+        changed = [symbol for symbol in symbols if symbol not in stored]
+        args = [self._symbol_args(symbol) for symbol in changed]
+
+        if self.jobs > 1 and len(changed) > 1:
+            # workers get rates resolved up front, results are merged in symbol order
+            tables = [nbp.rate_table(_symbol_rate_dates(*a)) for a in args]
+            with ProcessPoolExecutor(self.jobs) as executor:
+                results = list(executor.map(_symbol_cash_flow, *zip(*args), tables, chunksize=max(1, len(changed) // (self.jobs * 4))))
+        else:
+            results = (_symbol_cash_flow(*a, nbp) for a in args)
+        for symbol, cash_flow in zip(changed, results):
+            stored[symbol] = cash_flow
+            if self.results:
+                self.results.put(symbol, fingerprints[symbol], cash_flow)
+
+        self.cash_flows = {}
+        if self.year_end:
+            self.cash_flows = {year: {symbol: list(items) for symbol, items in realized.items()} for year, realized in self.year_end.realized.items()}
+        for symbol in symbols:
+            cash_flow = stored[symbol]
+            if cash_flow is None:
                 self._warning_handler(f"No BUY transactions for symbol: {symbol}.")
                 continue
-
-            def _cf(year: int, symbol: str):
-                if year not in self.cash_flows:
-                    self.cash_flows[year] = {}
-                if symbol not in self.cash_flows[year]:
-                    self.cash_flows[year][symbol] = []
-                return self.cash_flows[year][symbol]
-
-            for s in sell:
-                pln = nbp.get_nbp_day_before(s.currency, s.time)
-                cf = _cf(s.time.year, symbol)
-                cf.append(CashFlowItem(CashFlowItemType.TRADE, s.time, s.count, s.price, s.currency, pln))
-                cf.append(CashFlowItem(CashFlowItemType.COMMISSION, s.time, -1, s.commission, s.currency, pln))
-
-                while s.count and buy:
-                    b = buy[0]
-                    b.count -= s.count
-                    pln = nbp.get_nbp_day_before(s.currency, b.time)
-                    if b.count <= 0:  # more to sell or everything sold
-                        cf.append(CashFlowItem(CashFlowItemType.TRADE, b.time, -(b.count + s.count), b.price, s.currency, pln))
-                        cf.append(CashFlowItem(CashFlowItemType.COMMISSION, b.time, -1, b.commission, s.currency, pln))  # full cost
-                        s.count = -b.count  # left count
-                        del buy[0]  # remove matching buy transaction
-                    else:  # partial sell
-                        cf.append(CashFlowItem(CashFlowItemType.TRADE, b.time, -s.count, b.price, s.currency, pln))
-                        ratio = Decimal(s.count / (s.count + b.count))
-                        commission = round(b.commission * ratio, 2)
-                        cf.append(CashFlowItem(CashFlowItemType.COMMISSION, b.time, -1, commission, s.currency,
-                                               nbp.get_nbp_day_before(s.currency, s.time)))  # partial cost
-                        b.commission -= commission
-                        break
-            for d in dividend:
-                pln = nbp.get_nbp_day_before(d.currency, d.time)
-                cf = _cf(d.time.year, symbol)
-                cf.append(CashFlowItem(CashFlowItemType.DIVIDEND, d.time, 1, d.value, d.currency, pln))
-                cf.append(CashFlowItem(CashFlowItemType.TAX, d.time, 1, d.tax, d.currency, pln))
+            for year, items in cash_flow.items():
+                self.cash_flows.setdefault(year, {}).setdefault(symbol, []).extend(items)
+
+    def _fingerprint(self, symbol: str):
+        # transactions and year-end lots cash flow of symbol is calculated from
+        fingerprint = hashlib.blake2b(repr((self.CASH_FLOW_VERSION, self.year_end.year if self.year_end else None)).encode(), digest_size=16)
+        for t in self._since_year_end(self.transaction_log[symbol]):
+            fingerprint.update(repr(t.fields()).encode())
+        for lot in self.year_end.lots.get(symbol, []) if self.year_end else []:
+            fingerprint.update(repr((lot.buy.fields(), lot.count, lot.commission)).encode())
+        return fingerprint.hexdigest()
+
+    def _symbol_fingerprint(self, symbol: str):
+        return self._fingerprints[symbol] if self._fingerprints else self._fingerprint(symbol)
+
+    def _since_year_end(self, transactions):
+        return [t for t in transactions if t.time.year > self.year_end.year] if self.year_end else transactions
+
+    def _symbol_args(self, symbol: str):
+        # (sell, buy, dividend, lots) arguments of _symbol_cash_flow of symbol
+        sides = [self._since_year_end(self.transaction_log.side(symbol, side)) for side in (TransactionSide.SELL, TransactionSide.BUY, TransactionSide.DIVIDEND)]
+        return (*sides, self.year_end.lots.get(symbol, []) if self.year_end else [])
+
+    def _exchange_rate_dates(self):
+        # only rates cash flow calculation uses, e.g. rates of open lots or of symbols with stored cash flow are not needed
+        symbols = [symbol for symbol in self.transaction_log if not self._is_stored(symbol)] if self.results else list(self.transaction_log)
+        for symbol in symbols:
+            yield from _symbol_rate_dates(*self._symbol_args(symbol))
+
+    def _is_stored(self, symbol: str):
+        try:
+            self.results.get(symbol, self._symbol_fingerprint(symbol))
+            return True
+        except KeyError:
+            return False
+
+    def year_end_snapshot(self, year: int) -> YearEndSnapshot:
+        """FIFO state at the end of year, realized cash flows are taken from calculated cash_flows."""
+        if self.year_end and year < self.year_end.year:
+            raise ValueError(f"Calculation starts from the end of {self.year_end.year}, snapshot of {year} can't be made.")
+        lots = {}
+        start = self.year_end.lots if self.year_end else {}
+        for symbol in list(start) + [symbol for symbol in self.transaction_log if symbol not in start]:
+            sell, buy = [[t for t in self._since_year_end(self.transaction_log.side(symbol, side)) if t.time.year <= year]
+                         for side in (TransactionSide.SELL, TransactionSide.BUY)]
+            open_lots = deque(copy.copy(lot) for lot in start.get(symbol, []))
+            for _ in match_fifo(sell, buy, open_lots):
+                pass
+            if open_lots:
+                lots[symbol] = list(open_lots)
+        realized = {y: {symbol: list(items) for symbol, items in symbols.items()} for y, symbols in self.cash_flows.items() if y <= year}
+        return YearEndSnapshot(year, lots, realized)
+
+    def check_year_end(self, snapshot: YearEndSnapshot, nbp) -> List[str]:
+        """
+        Differences between calculation started from snapshot and full calculation of this account (cash flow initialized from complete
+        transaction log), empty if the snapshot is consistent.
+        """
+
+        def _lots(s: YearEndSnapshot):
+            return {symbol: [(lot.buy.time, lot.buy.price, lot.buy.currency, lot.count, lot.commission) for lot in lots] for symbol, lots in s.lots.items()}
+
+        def _cash_flows(cash_flows, years):
+            return {(year, symbol): [(cf.type, cf.time, cf.count, cf.price, cf.currency, cf.pln) for cf in items]
+                    for year, symbols in cash_flows.items() if year in years for symbol, items in symbols.items()}
+
+        differences = []
+        expected = self.year_end_snapshot(snapshot.year)
+        expected_lots, snapshot_lots = _lots(expected), _lots(snapshot)
+        for symbol in sorted(set(expected_lots) | set(snapshot_lots)):
+            if expected_lots.get(symbol) != snapshot_lots.get(symbol):
+                differences.append(f"{symbol}: open lots at the end of {snapshot.year} differ.")
+
+        full = self.cash_flows
+        year_end, results = self.year_end, self.results
+        self.year_end, self.results = snapshot, None
+        try:
+            self._load_cash_flow(nbp)
+            incremental = self.cash_flows
+        finally:
+            self.year_end, self.results = year_end, results
+            self.cash_flows = full
+
+        years = set(full) | set(incremental)
+        expected_flows, snapshot_flows = _cash_flows(full, years), _cash_flows(incremental, years)
+        for year, symbol in sorted(set(expected_flows) | set(snapshot_flows)):
+            if expected_flows.get((year, symbol)) != snapshot_flows.get((year, symbol)):
+                differences.append(f"{symbol}: cash flow of {year} differs.")
+        return differences
+
+    def _totals(self):
+        # all reports are projections of totals computed in one pass over cash flows
+        if self._report_totals is None or self._report_totals[0] is not self.cash_flows:
+            self._report_totals = (self.cash_flows, CashFlowTotals(self.cash_flows))
+        return self._report_totals[1]
 
     def get_foreign(self):
+        totals = self._totals()
         table = [["symbol", "currency", "income", "cost", "P/L", "(commission)"]]
         for year in self.cash_flows:
             table.append([year, " ", " ", " ", " ", " "])
             for symbol, cash_flow in self.cash_flows[year].items():
                 if cash_flow:  # output only items with data
-                    trade_income = sum([cf.count * cf.price for cf in cash_flow if cf.count > 0 and cf.type == CashFlowItemType.TRADE])
+                    trade_income = totals.value(year, symbol, CashFlowItemType.TRADE, 1)
                     if trade_income:
-                        trade_cost = -sum([cf.count * cf.price for cf in cash_flow if cf.count < 0 and cf.type == CashFlowItemType.TRADE])
-                        commission_cost = -sum([cf.count * cf.price for cf in cash_flow if cf.type == CashFlowItemType.COMMISSION])
-                        assert sum(
-                            [cf.count * cf.price for cf in cash_flow if cf.count > 0 and cf.type == CashFlowItemType.COMMISSION]) == 0, f"commission_cost != 0"
+                        trade_cost = -totals.value(year, symbol, CashFlowItemType.TRADE, -1)
+                        commission_cost = -totals.value(year, symbol, CashFlowItemType.COMMISSION)
+                        assert totals.value(year, symbol, CashFlowItemType.COMMISSION, 1) == 0, f"commission_cost != 0"
 
                         table.append(
                             [symbol, cash_flow[0].currency, trade_income, trade_cost + commission_cost, trade_income - trade_cost - commission_cost,
@@ -155,6 +291,7 @@ class ExanteAccount(AccountBase):
         return table
 
     def get_pln(self):
+        totals = self._totals()
         table = [["symbol", "income", "cost", "P/L", "(commission)"]]
 
         for year in self.cash_flows:
@@ -163,10 +300,10 @@ class ExanteAccount(AccountBase):
             table.append([year, " ", " ", " ", " ", " "])
             for symbol, cashflow in self.cash_flows[year].items():
                 if cashflow:  # output only items with data
-                    trade_income = sum([round(cf.count * cf.price * cf.pln, 2) for cf in cashflow if cf.count > 0 and cf.type == CashFlowItemType.TRADE])
+                    trade_income = totals.pln(year, symbol, CashFlowItemType.TRADE, 1)
                     if trade_income:
-                        trade_cost = -sum([round(cf.count * cf.price * cf.pln, 2) for cf in cashflow if cf.count < 0 and cf.type == CashFlowItemType.TRADE])
-                        commission_cost = -sum([round(cf.count * cf.price * cf.pln, 2) for cf in cashflow if cf.type == CashFlowItemType.COMMISSION])
+                        trade_cost = -totals.pln(year, symbol, CashFlowItemType.TRADE, -1)
+                        commission_cost = -totals.pln(year, symbol, CashFlowItemType.COMMISSION)
 
                         table.append([symbol, trade_income, trade_cost + commission_cost, trade_income - trade_cost - commission_cost, commission_cost])
                         total_trade_income += trade_income
@@ -177,31 +314,33 @@ class ExanteAccount(AccountBase):
         return table
 
     def get_pln_total(self):
+        totals = self._totals()
         table = [["year", "income\r[PIT38 C22]", "cost\r[PIT38 C23]", "P/L"]]
         for year in self.cash_flows:
-            trade_income = sum([round(cf.count * cf.price * cf.pln, 2) for key in self.cash_flows[year] for cf in self.cash_flows[year][key] if
-                                cf.count > 0 and cf.type == CashFlowItemType.TRADE])
-            trade_cost = -sum([round(cf.count * cf.price * cf.pln, 2) for key in self.cash_flows[year] for cf in self.cash_flows[year][key] if cf.count < 0])
+            trade_income = totals.pln(year, type=CashFlowItemType.TRADE, sign=1)
+            trade_cost = -totals.pln(year, sign=-1)
             table.append([year, trade_income, trade_cost, trade_income - trade_cost])
         return table
 
     def get_dividends(self):
+        totals = self._totals()
         table = [["year", "symbol", "currency", "income", "paid tax", "%"]]
         for year in self.cash_flows:
             for symbol, cashflow in self.cash_flows[year].items():
                 if cashflow:  # output only items with data
-                    income = sum([cf.price for cf in cashflow if cf.type == CashFlowItemType.DIVIDEND])
-                    tax = sum([cf.price for cf in cashflow if cf.type == CashFlowItemType.TAX])
+                    income = totals.price(year, symbol, CashFlowItemType.DIVIDEND)
+                    tax = totals.price(year, symbol, CashFlowItemType.TAX)
                     if income > 0:
                         percent = round(tax / income * 100)
                         table.append([year, symbol, cashflow[0].currency, income, tax, percent])
         return table
 
     def get_dividends_pln(self):
+        totals = self._totals()
         table = [["year", "income", "paid tax\r[PIT38 G45]", "%", "total to pay (19%)\r[PIT38 G46]", "left to pay (19%)\r[PIT38 G47]"]]
         for year in self.cash_flows:
-            income = sum([round(cf.count * cf.price * cf.pln, 2) for key in self.cash_flows[year] for cf in self.cash_flows[year][key] if cf.type == CashFlowItemType.DIVIDEND])
-            paid_tax = sum([round(cf.count * cf.price * cf.pln, 2) for key in self.cash_flows[year] for cf in self.cash_flows[year][key] if cf.type == CashFlowItemType.TAX])
+            income = totals.pln(year, type=CashFlowItemType.DIVIDEND)
+            paid_tax = totals.pln(year, type=CashFlowItemType.TAX)
             if income > 0:
                 percent = round(paid_tax / income * 100)
                 tax = round(income * Decimal("0.19"), 2)
@@ -209,3 +348,76 @@ class ExanteAccount(AccountBase):
                 table.append([year, income, paid_tax, percent, tax, left_to_pay])
         return table
 
+
+def _symbol_rate_dates(sell: List[TradeTransaction], buy: List[TradeTransaction], dividend: List[DividendTransaction], lots: List[Lot]):
+    """(currency, time) of exchange rates used by _symbol_cash_flow with the same arguments."""
+    if not buy and not dividend and not lots:
+        return
+    for s, matches in match_fifo(sell, buy, deque(copy.copy(lot) for lot in lots)):
+        yield s.currency, s.time
+        for m in matches:
+            yield s.currency, m.buy.time
+    for d in dividend:
+        yield d.currency, d.time
+
+
+def _symbol_cash_flow(sell: List[TradeTransaction], buy: List[TradeTransaction], dividend: List[DividendTransaction], lots: List[Lot], nbp):
+    """Cash flow items of one symbol {year: [cash_flow_item,...]}, None if there is nothing to match sells with."""
+    if not buy and not dividend and not lots:
+        return None
+
+    cash_flow = {}
+    for s, matches in match_fifo(sell, buy, deque(copy.copy(lot) for lot in lots)):
+        pln = nbp.get_nbp_day_before(s.currency, s.time)
+        cf = cash_flow.setdefault(s.time.year, [])
+        cf.append(CashFlowItem(CashFlowItemType.TRADE, s.time, s.count, s.price, s.currency, pln))
+        cf.append(CashFlowItem(CashFlowItemType.COMMISSION, s.time, -1, s.commission, s.currency, pln))
+
+        for m in matches:
+            pln = nbp.get_nbp_day_before(s.currency, m.buy.time)
+            cf.append(CashFlowItem(CashFlowItemType.TRADE, m.buy.time, -m.count, m.buy.price, s.currency, pln))
+            if m.partial:  # partial cost
+                pln = nbp.get_nbp_day_before(s.currency, s.time)
+            cf.append(CashFlowItem(CashFlowItemType.COMMISSION, m.buy.time, -1, m.commission, s.currency, pln))
+    for d in dividend:
+        pln = nbp.get_nbp_day_before(d.currency, d.time)
+        cf = cash_flow.setdefault(d.time.year, [])
+        cf.append(CashFlowItem(CashFlowItemType.DIVIDEND, d.time, 1, d.value, d.currency, pln))
+        cf.append(CashFlowItem(CashFlowItemType.TAX, d.time, 1, d.tax, d.currency, pln))
+    return cash_flow
+
+
+def _parse_record(row: List[str]):
+    """
+    Stateless part of row parsing, runs in worker processes of parallel parsing.
+    Record (id, op type, time, symbol, isin, asset, amount) of row, None for skipped row. Amount is count of trade row of the asset, Decimal otherwise.
+    Record of unsupported operation has op type only, it is reported when attached.
+    """
+    op_type = row[Column.OP_TYPE]
+
+    if op_type == "FUNDING/WITHDRAWAL":
+        return None
+
+    if op_type not in SUPPORTED_OP_TYPES:
+        return row[Column.ID], op_type, None, None, None, None, None
+
+    time = datetime.fromisoformat(row[Column.TIME])
+    isin = sys.intern(row[Column.ISIN])
+    asset = sys.intern(row[Column.ASSET])
+    symbol = sys.intern(row[Column.SYMBOL])
+    amount = int(row[Column.SUM]) if op_type == "TRADE" and isin != "None" and asset == symbol else Decimal(row[Column.SUM])
+    return row[Column.ID], op_type, time, symbol, isin, asset, amount
+
+
+def _parse_chunk(file, codec, chunk, header, delimiter):
+    # worker process part of parallel parsing: records of file byte range, sorted by transaction id
+    begin, end = chunk
+    with open(file, "rb") as f:
+        f.seek(begin)
+        text = f.read(end - begin).decode(codec)
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+    if header:
+        next(reader, None)
+    records = [record for record in map(_parse_record, reader) if record is not None]
+    records.sort(key=itemgetter(0))
+    return records
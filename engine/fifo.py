@@ -0,0 +1,83 @@
+import pickle
+from collections import deque
+from decimal import Decimal
+from typing import Deque, Dict, Iterable, Iterator, List, Tuple
+
+from engine.transaction import CashFlowItem, TradeTransaction
+
+
+class Lot:
+    """Open part of buy transaction: count and commission not yet matched with sells."""
+
+    __slots__ = ("buy", "count", "commission")
+
+    def __init__(self, buy: TradeTransaction):
+        self.buy = buy
+        self.count = buy.count
+        self.commission = buy.commission
+
+
+class LotMatch:
+    """
+    Part of buy lot closed by sell transaction.
+    partial - lot stays open after this match, commission is the part proportional to matched count.
+    """
+
+    __slots__ = ("buy", "count", "commission", "partial")
+
+    def __init__(self, buy: TradeTransaction, count: int, commission: Decimal, partial: bool):
+        self.buy = buy
+        self.count = count
+        self.commission = commission
+        self.partial = partial
+
+
+def match_fifo(sells: Iterable[TradeTransaction], buys: Iterable[TradeTransaction], lots: Deque[Lot] = None) -> Iterator[Tuple[TradeTransaction, List[LotMatch]]]:
+    """
+    Match sells with buy lots in FIFO order, yields (sell, [lot match,...]) for each sell.
+    Transactions are not modified, open lots are kept in a queue, so each lot is consumed in O(1).
+    Sell count exceeding all open lots is left unmatched.
+    :param lots: lots open before buys, updated in place - after matching it holds lots left open
+    """
+    lots = deque() if lots is None else lots
+    lots.extend(Lot(b) for b in buys)
+    for s in sells:
+        count = s.count
+        matches = []
+        while count and lots:
+            lot = lots[0]
+            if lot.count <= count:  # more to sell or everything sold
+                matches.append(LotMatch(lot.buy, lot.count, lot.commission, False))
+                count -= lot.count
+                lots.popleft()
+            else:  # partial sell
+                commission = round(lot.commission * Decimal(count / lot.count), 2)
+                matches.append(LotMatch(lot.buy, count, commission, True))
+                lot.count -= count
+                lot.commission -= commission
+                break
+        yield s, matches
+
+
+class YearEndSnapshot:
+    """
+    FIFO state at the end of year: lots left open {symbol: [lot,...]} and realized cash flows {year: {symbol: [cash_flow_item,...]}} up to the year.
+    Calculation of later years can start from it instead of matching all trades since account opening.
+    """
+
+    def __init__(self, year: int, lots: Dict[str, List[Lot]], realized: Dict[int, Dict[str, List[CashFlowItem]]]):
+        self.year = year
+        self.lots = lots
+        self.realized = realized
+
+    def save(self, file: str):
+        with open(file, "wb") as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(file: str):
+        with open(file, "rb") as f:
+            snapshot = pickle.load(f)
+        if not isinstance(snapshot, YearEndSnapshot):
+            raise ValueError(f"{file} is not a year-end snapshot.")
+        return snapshot
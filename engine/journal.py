@@ -0,0 +1,67 @@
+import hashlib
+import os
+import pickle
+from typing import Dict, Iterable, List
+
+from engine.transaction import TransactionBase, TransactionSide
+
+
+class Journal(dict):
+    """
+    Append-only transaction log: {symbol: [transaction,...]} in parse (time) order.
+    Transactions are additionally indexed by symbol and side, so cash flow calculation doesn't need to scan whole log per side.
+    Append is amortized O(1).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._sides: Dict[str, Dict[TransactionSide, List[TransactionBase]]] = {}
+
+    def append(self, item: TransactionBase):
+        transactions = self.get(item.symbol, None)
+        if transactions is None:
+            transactions = self[item.symbol] = []
+        transactions.append(item)
+        self._sides.setdefault(item.symbol, {}).setdefault(item.side, []).append(item)
+
+    def side(self, symbol: str, side: TransactionSide) -> List[TransactionBase]:
+        """Transactions of symbol and side in time order."""
+        return self._sides.get(symbol, {}).get(side, [])
+
+    def clear(self):
+        super().clear()
+        self._sides.clear()
+
+
+class JournalCache:
+    """
+    Snapshots of parsed transaction logs stored in directory, one per source file or directory.
+    Snapshot is valid while its key (parser version, source files paths, modification times and sizes) doesn't change.
+    """
+
+    def __init__(self, directory: str = ".journal_cache"):
+        self.directory = directory
+
+    def _file(self, source: str):
+        return os.path.join(self.directory, hashlib.sha256(os.path.abspath(source).encode("utf-8")).hexdigest()[:32] + ".pickle")
+
+    @staticmethod
+    def key(files: Iterable[str], *version):
+        stats = [(os.path.abspath(file), os.stat(file)) for file in files]
+        return version + tuple((path, stat.st_mtime_ns, stat.st_size) for path, stat in stats)
+
+    def load(self, source: str, key: tuple):
+        """Snapshot stored for source with the same key, None if there is none."""
+        try:
+            with open(self._file(source), "rb") as f:
+                stored_key, snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            return None
+        return snapshot if stored_key == key else None
+
+    def save(self, source: str, key: tuple, snapshot):
+        os.makedirs(self.directory, exist_ok=True)
+        file = self._file(source)
+        with open(file + ".tmp", "wb") as f:
+            pickle.dump((key, snapshot), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(file + ".tmp", file)
@@ -1,10 +1,13 @@
 # Mintos transaction log column positions
+import sys
 from datetime import datetime
 from decimal import Decimal
 from typing import List
 
 from engine.account import AccountBase
-from engine.transaction import DividendTransaction, CashFlowItem, CashFlowItemType, TransactionSide
+from engine.journal import JournalCache
+from engine.report import sum_columns
+from engine.transaction import DividendTransaction, CashFlowColumns, CashFlowItemType, TransactionSide
 
 
 class Column:
@@ -21,15 +24,33 @@ class MintosAccount(AccountBase):
    Store Transactions list in dictionary using symbol as a key (one transaction group)
 3. For each Transaction create CashFlowItem (DIVIDEND), getting amount in PLN based D-1 exchange rate,
    where transaction time is T+0.  Store each CashFlowItem list in a dictionary.
+   In aggregate mode income is summed per currency and day during parsing, so there is one CashFlowItem per (currency, day).
 
     During sum calculations Use round(2) on CashFlowItem level after multiplication count * price * pln exchange rate before sum. Decimal is used for
     floating pont calculations.
 
     """
 
+    _parsed = ("transaction_log", "totals")
+    _parser_options = ("aggregate",)
+
+    def __init__(self, warning_handler=None, aggregate: bool = False, journal_cache: JournalCache = None, arithmetic: str = "decimal"):
+        """
+        :param aggregate: fold income rows into per (currency, day) sums while parsing, instead of keeping every transaction
+        :param journal_cache: cache of parsed transaction logs
+        :param arithmetic: "decimal" or "numpy" - sums of cash flow columns in int64 arrays, when numpy is installed
+        """
+        super().__init__(warning_handler, journal_cache)
+        self.aggregate = aggregate
+        self.arithmetic = arithmetic
+        self.totals = {}  # {(currency, date): income} in aggregate mode
+
     def load_transaction_log(self, file):
         super()._load_transaction_log(file, "ASCII", ',', lambda i: i[Column.TIME])
 
+    def load_transaction_logs(self, directory):
+        super()._load_transaction_logs(directory, "ASCII", ',', lambda i: i[Column.TIME])
+
     def _parse(self, row: List[str]):
         if len(row) == 1:  # skip invalid entries
             return
@@ -47,33 +68,56 @@ class MintosAccount(AccountBase):
 
         time = datetime.fromisoformat(row[Column.TIME])
         value = Decimal(row[Column.TURNOVER])
-        currency = row[Column.CURRENCY]
+        currency = sys.intern(row[Column.CURRENCY])
         symbol = "Mintos"
+        if self.aggregate:
+            key = (currency, time.date())
+            self.totals[key] = self.totals.get(key, 0) + value
+            return
         log_item = DividendTransaction(time=time, value=value, symbol=symbol, currency=currency)
-        self.transaction_log[symbol] = [log_item] if symbol not in self.transaction_log.keys() else self.transaction_log[symbol] + [log_item]
+        self.transaction_log.append(log_item)
+
+    def _exchange_rate_dates(self):
+        yield from super()._exchange_rate_dates()
+        for currency, day in self.totals:
+            yield currency, datetime.combine(day, datetime.min.time())
 
     def _load_cash_flow(self, nbp):
-        for symbol, tr in self.transaction_log.items():
-            dividend = [t for t in tr if t.side == TransactionSide.DIVIDEND]
-            cashflow = []
+        if self.aggregate:
+            # one item per (currency, day), all rows of a day share D-1 exchange rate
+            cashflow = CashFlowColumns()
+            for (currency, day), value in self.totals.items():
+                time = datetime.combine(day, datetime.min.time())
+                cashflow.append(CashFlowItemType.DIVIDEND, time, 1, value, currency, nbp.get_nbp_day_before(currency, time))
+            self.cash_flows["Mintos"] = cashflow
+            return
+
+        for symbol in self.transaction_log:
+            dividend = self.transaction_log.side(symbol, TransactionSide.DIVIDEND)
+            cashflow = CashFlowColumns()
             for d in dividend:
                 pln = nbp.get_nbp_day_before(d.currency, d.time)
-                cashflow.append(CashFlowItem(CashFlowItemType.DIVIDEND, d.time, 1, d.value, d.currency, pln))
+                cashflow.append(CashFlowItemType.DIVIDEND, d.time, 1, d.value, d.currency, pln)
 
             self.cash_flows[symbol] = cashflow
 
+    def _sum(self, cashflow: CashFlowColumns, type: CashFlowItemType, pln: bool = False):
+        if self.arithmetic == "numpy":
+            return sum_columns(cashflow, type, pln)
+        return cashflow.sum_price_pln(type) if pln else cashflow.sum_price(type)
+
     def get_foreign(self):
         table = [["", "currency", "income"]]
         for symbol, cashflow in self.cash_flows.items():
             if cashflow:  # output only items with data
-                income = sum([cf.price for cf in cashflow if cf.type == CashFlowItemType.DIVIDEND])
+                income = self._sum(cashflow, CashFlowItemType.DIVIDEND)
                 if income > 0:
                     table.append([symbol, cashflow[0].currency, income])
         return table
 
     def get_pln(self):
         table = [["income", "total to pay (19%)\r[PIT38 G46]", "tax (19%)\r[PIT38 G47]"]]
-        income = round(sum([cf.price * cf.pln for key in self.cash_flows for cf in self.cash_flows[key] if cf.type == CashFlowItemType.DIVIDEND]), 2)
+        income = round(sum(self._sum(cashflow, CashFlowItemType.DIVIDEND, True) for cashflow in self.cash_flows.values()), 2)
         if income > 0:
             tax = round(income * Decimal("0.19"), 2)
             table.append([income, tax, round(tax)])
@@ -0,0 +1,125 @@
+from array import array
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from engine.transaction import CashFlowColumns, CashFlowItem, CashFlowItemType
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+_SIGNS = (1, -1, 0)
+
+
+def _sign(count: int):
+    return 1 if count > 0 else -1 if count < 0 else 0
+
+
+class CashFlowTotals:
+    """
+    Totals of cash flow items per (year, symbol, type, sign of count), computed in one pass over cash flows:
+    value - sum(count * price), price - sum(price), pln - sum(round(count * price * pln, 2)).
+    Items are summed in cash flow order starting from 0, so totals are equal to sums over filtered cash flow items.
+    """
+
+    VALUE, PRICE, PLN = 0, 1, 2
+
+    def __init__(self, cash_flows: Dict[int, Dict[str, List[CashFlowItem]]]):
+        self.totals = {}  # {(year, symbol, type, sign): [value, price, pln]}
+        self.symbols = {}  # {year: [symbol,...]}
+        self.missing = set()  # keys of items without price
+        for year, symbols in cash_flows.items():
+            self.symbols[year] = list(symbols)
+            for symbol, items in symbols.items():
+                for cf in items:
+                    key = (year, symbol, cf.type, _sign(cf.count))
+                    if cf.price is None:
+                        self.missing.add(key)
+                        continue
+                    total = self.totals.get(key, None)
+                    if total is None:
+                        total = self.totals[key] = [0, 0, 0]
+                    value = cf.count * cf.price
+                    total[0] += value
+                    total[1] += cf.price
+                    total[2] += round(value * cf.pln, 2)
+
+    def _total(self, field: int, year: int, symbol: Optional[str], type: Optional[CashFlowItemType], sign: Optional[int]):
+        total = 0
+        for s in [symbol] if symbol is not None else self.symbols.get(year, []):
+            for t in [type] if type is not None else CashFlowItemType:
+                for g in [sign] if sign is not None else _SIGNS:
+                    key = (year, s, t, g)
+                    if key in self.missing:
+                        raise TypeError(f"Missing price of {t.name} cash flow item of {s} in {year}.")
+                    bucket = self.totals.get(key, None)
+                    if bucket:
+                        total += bucket[field]
+        return total
+
+    def value(self, year: int, symbol: str = None, type: CashFlowItemType = None, sign: int = None):
+        return self._total(self.VALUE, year, symbol, type, sign)
+
+    def price(self, year: int, symbol: str = None, type: CashFlowItemType = None, sign: int = None):
+        return self._total(self.PRICE, year, symbol, type, sign)
+
+    def pln(self, year: int, symbol: str = None, type: CashFlowItemType = None, sign: int = None):
+        return self._total(self.PLN, year, symbol, type, sign)
+
+
+def _to_fixed(value):
+    # (coefficient, exponent) of int or Decimal value
+    if isinstance(value, int):
+        return value, 0
+    sign, digits, exponent = value.as_tuple()
+    coefficient = int("".join(map(str, digits)))
+    return -coefficient if sign else coefficient, exponent
+
+
+def _column(values: array):
+    return numpy.frombuffer(values, dtype=numpy.dtype(values.typecode))
+
+
+def sum_columns(columns: CashFlowColumns, type: CashFlowItemType, pln: bool = False):
+    """
+    sum(price) or sum(price * pln) of items of type, equal to Decimal sum in item order.
+    Distinct values are scaled to common exponent and summed in numpy int64 array, where sum is exact (then Decimal one is exact as well).
+    Falls back to Decimal sum without numpy or when int64 could overflow.
+    """
+    def _decimal_sum():
+        return columns.sum_price_pln(type) if pln else columns.sum_price(type)
+
+    if numpy is None or not len(columns):
+        return _decimal_sum()
+    mask = _column(columns.types) == type.value
+    if not mask.any():
+        return 0
+
+    def _scaled(values, index):
+        fixed = [_to_fixed(value) for value in values]
+        exponent = min(e for _, e in fixed)
+        scaled = [c * 10 ** (e - exponent) for c, e in fixed]
+        exponents = numpy.array([e for _, e in fixed], dtype=numpy.int64)[index]
+        return scaled, exponent, exponents
+
+    price = _column(columns.prices)[mask]
+    scaled, exponent, exponents = _scaled(columns.price_values.values, price)
+    bound = max(map(abs, scaled))
+    if pln:
+        rate = _column(columns.plns)[mask]
+        scaled_plns, pln_exponent, pln_exponents = _scaled(columns.pln_values.values, rate)
+        bound *= max(map(abs, scaled_plns))
+        exponent += pln_exponent
+        exponents = exponents + pln_exponents
+    if bound * len(price) >= 2 ** 63:
+        return _decimal_sum()
+
+    terms = numpy.array(scaled, dtype=numpy.int64)[price]
+    if pln:
+        terms = terms * numpy.array(scaled_plns, dtype=numpy.int64)[rate]
+    total = int(terms.sum())
+    # Decimal sum starting from int 0 has the smallest exponent of its terms
+    result_exponent = min(0, int(exponents.min()))
+    return Decimal(total // 10 ** (result_exponent - exponent)).scaleb(result_exponent)
+
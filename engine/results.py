@@ -0,0 +1,33 @@
+import shelve
+
+
+class ResultStore:
+    """
+    Persisted cash flow of symbols: {symbol: (fingerprint, cash flow)}.
+    Fingerprint identifies transactions the cash flow was calculated from, so only symbols with changed transactions are calculated again.
+    """
+
+    def __init__(self, file: str = ".results"):
+        self.file = file
+        self._shelf = None
+
+    @property
+    def shelf(self):
+        if self._shelf is None:
+            self._shelf = shelve.open(self.file)
+        return self._shelf
+
+    def get(self, symbol: str, fingerprint: str):
+        """Cash flow of symbol calculated from transactions with the fingerprint, KeyError if there is none."""
+        entry = self.shelf.get(symbol, None)
+        if entry is None or entry[0] != fingerprint:
+            raise KeyError(symbol)
+        return entry[1]
+
+    def put(self, symbol: str, fingerprint: str, cash_flow):
+        self.shelf[symbol] = (fingerprint, cash_flow)
+
+    def close(self):
+        if self._shelf is not None:
+            self._shelf.close()
+            self._shelf = None
@@ -0,0 +1,84 @@
+import sqlite3
+import time
+from datetime import date as Date
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (currency TEXT NOT NULL, day TEXT NOT NULL, mid TEXT NOT NULL, PRIMARY KEY (currency, day)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rates_day ON rates (day);
+CREATE TABLE IF NOT EXISTS tables (day TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS calendar (day TEXT PRIMARY KEY, published INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS misses (currency TEXT NOT NULL, day TEXT NOT NULL, reason TEXT NOT NULL, expires REAL NOT NULL,
+                                   PRIMARY KEY (currency, day)) WITHOUT ROWID;
+"""
+
+
+def is_sqlite_file(file: str):
+    with open(file, "rb") as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+class RateStore:
+    """
+    Persistent NBP exchange rate store in SQLite database.
+    Rates are indexed by (currency, day) and by day, so point and range lookups are O(log n) and nothing is loaded upfront.
+    Writes are upserts committed in small transactions, WAL journal lets parallel processes share one store.
+    Failed lookups are kept apart from rates, as misses expiring after given time.
+    """
+
+    def __init__(self, file: str):
+        self.connection = sqlite3.connect(file, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+
+    def rate(self, currency: str, day: Date) -> Optional[Decimal]:
+        row = self.connection.execute("SELECT mid FROM rates WHERE currency = ? AND day = ?", (currency, str(day))).fetchone()
+        return Decimal(row[0]) if row else None
+
+    def rates(self, currency: str, start: Date, end: Date) -> Dict[Date, Decimal]:
+        rows = self.connection.execute("SELECT day, mid FROM rates WHERE currency = ? AND day BETWEEN ? AND ?", (currency, str(start), str(end)))
+        return {Date.fromisoformat(day): Decimal(mid) for day, mid in rows}
+
+    def day(self, day: Date):
+        """All rates published on day: ({currency: rate}, True if complete table A is stored)."""
+        rates = {currency: Decimal(mid) for currency, mid in self.connection.execute("SELECT currency, mid FROM rates WHERE day = ?", (str(day),))}
+        complete = self.connection.execute("SELECT 1 FROM tables WHERE day = ?", (str(day),)).fetchone() is not None
+        return rates, complete
+
+    def upsert(self, day: Date, rates: Dict[str, Decimal], complete: bool = False):
+        self.connection.executemany("INSERT OR REPLACE INTO rates (currency, day, mid) VALUES (?, ?, ?)",
+                                    ((currency, str(day), str(mid)) for currency, mid in rates.items()))
+        if complete:
+            self.connection.execute("INSERT OR IGNORE INTO tables (day) VALUES (?)", (str(day),))
+
+    def calendar(self):
+        """Calendar corrections: (publication days, days without publication)."""
+        rows = [(Date.fromisoformat(day), published) for day, published in self.connection.execute("SELECT day, published FROM calendar")]
+        return {day for day, published in rows if published}, {day for day, published in rows if not published}
+
+    def mark(self, days: Iterable[Date], published: Optional[bool]):
+        """Store calendar correction for days, None removes correction."""
+        if published is None:
+            self.connection.executemany("DELETE FROM calendar WHERE day = ?", ((str(day),) for day in days))
+        else:
+            self.connection.executemany("INSERT OR REPLACE INTO calendar (day, published) VALUES (?, ?)", ((str(day), int(published)) for day in days))
+
+    def miss(self, currency: str, day: Date) -> Optional[str]:
+        """Reason of not expired failed lookup of currency rate for transaction day."""
+        row = self.connection.execute("SELECT reason FROM misses WHERE currency = ? AND day = ? AND expires > ?", (currency, str(day), time.time())).fetchone()
+        return row[0] if row else None
+
+    def add_miss(self, currency: str, day: Date, reason: str, ttl: float):
+        self.connection.execute("INSERT OR REPLACE INTO misses (currency, day, reason, expires) VALUES (?, ?, ?, ?)",
+                                (currency, str(day), reason, time.time() + ttl))
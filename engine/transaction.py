@@ -1,7 +1,9 @@
 from abc import ABCMeta
-from datetime import datetime
+from array import array
+from datetime import datetime, timedelta
 from decimal import Decimal
 from enum import Enum
+from typing import Iterator
 
 
 class TransactionSide(Enum):
@@ -19,6 +21,8 @@ class CashFlowItemType(Enum):
 
 
 class CashFlowItem:
+    __slots__ = ("type", "time", "count", "price", "currency", "pln")
+
     def __init__(self, type: CashFlowItemType, time: datetime, count: int, price: Decimal, currency: str, pln: Decimal):
         self.type = type
         self.time = time
@@ -29,13 +33,21 @@ class CashFlowItem:
 
 
 class TransactionBase(metaclass=ABCMeta):
+    __slots__ = ("time", "side", "symbol")
+
     def __init__(self, time: datetime, side: TransactionSide, symbol: str):
         self.time = time
         self.side = side
         self.symbol = symbol
 
+    def fields(self) -> dict:
+        """{attribute: value} of transaction, base class attributes first."""
+        return {name: getattr(self, name) for cls in reversed(type(self).__mro__) for name in cls.__dict__.get("__slots__", ())}
+
 
 class TradeTransaction(TransactionBase):
+    __slots__ = ("price", "currency", "count", "commission")
+
     def __init__(self, time: datetime, side: TransactionSide, symbol: str, count: int, price: Decimal = None, currency: str = None, commission: Decimal = None):
         super().__init__(time, side, symbol)
         self.price = price
@@ -45,8 +57,85 @@ class TradeTransaction(TransactionBase):
 
 
 class DividendTransaction(TransactionBase):
+    __slots__ = ("value", "tax", "currency")
+
     def __init__(self, time: datetime, symbol: str, value: Decimal, currency: str, tax: Decimal = None):
         super().__init__(time, TransactionSide.DIVIDEND, symbol)
         self.value = value
         self.tax = tax
         self.currency = currency
+
+
+class _Interned:
+    """Table of distinct values, each value is stored once and referenced by index. Values are distinct by repr, so Decimal("1.0") and Decimal("1.00") are kept apart."""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def index(self, value) -> int:
+        key = repr(value)
+        i = self._index.get(key, None)
+        if i is None:
+            i = self._index[key] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def __getstate__(self):
+        return self.values
+
+    def __setstate__(self, values):
+        self.values = values
+        self._index = {repr(value): i for i, value in enumerate(values)}
+
+
+_TIME_ORIGIN = datetime.min
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class CashFlowColumns:
+    """
+    Cash flow items stored column-wise in parallel arrays: type, time (microseconds), count, and indexes of price, currency and pln.
+    Prices, currencies and exchange rates repeat a lot in long logs (interest amounts, daily rates), so they are interned.
+    Item costs a few dozen bytes instead of a CashFlowItem object. Iteration yields equal CashFlowItem objects one by one.
+    """
+
+    def __init__(self):
+        self.types = array("B")
+        self.times = array("q")
+        self.counts = array("q")
+        self.prices = array("L")
+        self.currencies = array("L")
+        self.plns = array("L")
+        self.price_values = _Interned()
+        self.currency_values = _Interned()
+        self.pln_values = _Interned()
+
+    def append(self, type: CashFlowItemType, time: datetime, count: int, price: Decimal, currency: str, pln: Decimal):
+        self.types.append(type.value)
+        self.times.append((time - _TIME_ORIGIN) // _MICROSECOND)
+        self.counts.append(count)
+        self.prices.append(self.price_values.index(price))
+        self.currencies.append(self.currency_values.index(currency))
+        self.plns.append(self.pln_values.index(pln))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i: int) -> CashFlowItem:
+        return CashFlowItem(CashFlowItemType(self.types[i]), _TIME_ORIGIN + self.times[i] * _MICROSECOND, self.counts[i],
+                            self.price_values.values[self.prices[i]], self.currency_values.values[self.currencies[i]],
+                            self.pln_values.values[self.plns[i]])
+
+    def __iter__(self) -> Iterator[CashFlowItem]:
+        return (self[i] for i in range(len(self)))
+
+    def sum_price(self, type: CashFlowItemType):
+        """sum(price) of items of type, in item order."""
+        prices = self.price_values.values
+        return sum(prices[p] for t, p in zip(self.types, self.prices) if t == type.value)
+
+    def sum_price_pln(self, type: CashFlowItemType):
+        """sum(price * pln) of items of type, in item order."""
+        prices, plns = self.price_values.values, self.pln_values.values
+        return sum(prices[p] * plns[r] for t, p, r in zip(self.types, self.prices, self.plns) if t == type.value)
@@ -1,8 +1,12 @@
 import click
 from tabulate import tabulate
 
+from engine.NBP import NBP
 from engine.exante import ExanteAccount
+from engine.fifo import YearEndSnapshot
+from engine.journal import JournalCache
 from engine.mintos import MintosAccount
+from engine.results import ResultStore
 from engine.utils import bcolors
 
 
@@ -25,6 +29,15 @@ class Mutex(click.Option):
         return super(Mutex, self).handle_parse_result(ctx, opts, args)
 
 
+class ChainGroup(click.Group):
+    """Chained group supporting two word commands (e.g. 'rates import'), as chain mode doesn't allow nested groups."""
+
+    def resolve_command(self, ctx, args):
+        if len(args) > 1 and f"{args[0]} {args[1]}" in self.commands:
+            args = [f"{args[0]} {args[1]}"] + args[2:]
+        return super(ChainGroup, self).resolve_command(ctx, args)
+
+
 def ls(text: str):
     text = text.strip() + " "
     print()
@@ -35,24 +48,45 @@ def warning_handler(e):
     print(f"{bcolors.WARNING}{e}{bcolors.ENDC}")
 
 
-@click.group(chain=True)
+@click.group(chain=True, cls=ChainGroup)
 def cli():
     pass
 
 
 @cli.command()
 @click.option('-i', '--input-file', help='Transaction log file name.', cls=Mutex, not_required_if=["input_directory"])
-@click.option('-d', '--input-directory', help='Directory containing transaction log file names (csv|txt extension).', cls=Mutex, not_required_if=["input_file"])
+@click.option('-d', '--input-directory', help='Directory containing transaction log file names (csv|txt extension), transactions repeated in overlapping files are loaded once.', cls=Mutex, not_required_if=["input_file"])
 @click.option('-c', '--calculation', required=True, multiple=True, type=click.Choice(['TRADE', 'TRADE_PLN', 'DIVIDEND', 'DIVIDEND_PLN'], case_sensitive=False),
               help="Calculation type")
-def exante(input_file, input_directory, calculation):
+@click.option('-j', '--jobs', default=1, type=click.IntRange(min=1), help="Number of processes parsing transaction log file and calculating symbols in parallel.")
+@click.option('--journal-cache/--no-journal-cache', default=True, help="Reuse parsed transaction logs of unchanged files.")
+@click.option('--year-end', type=click.Path(exists=True, dir_okay=False), help="Year-end snapshot file to start from, only later transactions are calculated.")
+@click.option('--save-year-end', type=(int, click.Path(dir_okay=False)), help="Save year-end snapshot of open lots and realized cash flow of YEAR into FILE.")
+@click.option('--check-year-end', type=click.Path(exists=True, dir_okay=False), help="Compare year-end snapshot file with calculation from complete transaction log.")
+@click.option('--incremental', is_flag=True, help="Store cash flow of symbols, calculate again only symbols with changed transactions.")
+def exante(input_file, input_directory, calculation, jobs, journal_cache, year_end, save_year_end, check_year_end, incremental):
     """Calculates trade income, cost, dividends and paid tax from Exante transaction log, using FIFO approach and D-1 NBP PLN exchange rate."""
-    account = ExanteAccount(warning_handler)
+    results = ResultStore() if incremental else None
+    account = ExanteAccount(warning_handler, jobs, JournalCache() if journal_cache else None, YearEndSnapshot.load(year_end) if year_end else None,
+                            results)
     if input_file:
         account.load_transaction_log(input_file)
     else:
         account.load_transaction_logs(input_directory)
-    account.init_cash_flow()
+    nbp = NBP()
+    account.init_cash_flow(nbp)
+    if results:
+        results.close()
+    if save_year_end:
+        account.year_end_snapshot(save_year_end[0]).save(save_year_end[1])
+    if check_year_end:
+        snapshot = YearEndSnapshot.load(check_year_end)
+        ls("YEAR-END CHECK")
+        differences = account.check_year_end(snapshot, nbp)
+        for difference in differences:
+            warning_handler(difference)
+        if not differences:
+            print(f"Snapshot of {snapshot.year} is consistent with complete calculation.")
     table = None
     for c in calculation:
         ls(f"{c}")
@@ -79,12 +113,15 @@ def exante(input_file, input_directory, calculation):
 
 @cli.command()
 @click.option('-i', '--input-file', help='Transaction log file name.', cls=Mutex, not_required_if=["input_directory"])
-@click.option('-d', '--input-directory', help='Directory containing transaction log file names.', cls=Mutex, not_required_if=["input_file"])
+@click.option('-d', '--input-directory', help='Directory containing transaction log file names (csv|txt extension), transactions repeated in overlapping files are loaded once.', cls=Mutex, not_required_if=["input_file"])
 @click.option('-c', '--calculation', required=True, multiple=True, type=click.Choice(['INCOME', 'INCOME_PLN'], case_sensitive=False),
               help="Calculation type")
-def mintos(input_file, input_directory, calculation):
+@click.option('-a', '--aggregate', is_flag=True, help="Sum income per currency and day while loading, for very large transaction logs.")
+@click.option('--journal-cache/--no-journal-cache', default=True, help="Reuse parsed transaction logs of unchanged files.")
+@click.option('--arithmetic', default="decimal", type=click.Choice(["decimal", "numpy"]), help="Arithmetic of income sums, numpy sums them in int64 arrays.")
+def mintos(input_file, input_directory, calculation, aggregate, journal_cache, arithmetic):
     """Calculates income and tax from Mintos transaction log, using D-1 NBP PLN exchange rate."""
-    account = MintosAccount()
+    account = MintosAccount(warning_handler, aggregate, JournalCache() if journal_cache else None, arithmetic)
     if input_file:
         account.load_transaction_log(input_file)
     else:
@@ -110,5 +147,30 @@ def mintos(input_file, input_directory, calculation):
             print(tabulate(table, headers="firstrow", floatfmt=".2f", tablefmt="presto"))
 
 
+@cli.command("rates import")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+def rates_import(file):
+    """Imports NBP table A yearly archive CSV file (archiwum_tab_a_YYYY.csv) into exchange rate cache."""
+    nbp = NBP()
+    days, currencies = nbp.import_archive(file)
+    nbp.close()
+    print(f"Imported {days} days of {currencies} currencies from {file}.")
+
+
+@cli.command("rates prefetch")
+@click.option('-y', '--year', required=True, multiple=True, type=int, help="Year of exchange rates.")
+@click.option('-c', '--currency', required=True, help="Comma separated currency codes, e.g. USD,EUR.")
+def rates_prefetch(year, currency):
+    """Fetches NBP exchange rates of whole years into cache and reports cache coverage."""
+    nbp = NBP()
+    currencies = [c.strip().upper() for c in currency.split(",") if c.strip()]
+    table = [["year", "currency", "days", "cached", "missing"]]
+    for y in year:
+        table += nbp.prefetch_year(y, currencies)
+    nbp.close()
+    ls("RATES")
+    print(tabulate(table, headers="firstrow", tablefmt="presto"))
+
+
 if __name__ == '__main__':
     cli()
@@ -1,6 +1,14 @@
+import csv
+import io
 import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
 
 from engine.account import AccountBase
+from engine.journal import Journal
+from engine.transaction import TradeTransaction, TransactionSide, DividendTransaction
 from engine.utils import ParseError
 from tests import BASE_DIR
 
@@ -16,6 +24,9 @@ class TestAccount(AccountBase):
     def load_transaction_log(self, file):
         self.tr_log += 1
 
+    def load_transaction_logs(self, directory):
+        self._load_transaction_logs(directory, "utf=16", '\t', lambda i: i[0])
+
     def _load_cash_flow(self, nbp):
         pass
 
@@ -23,7 +34,23 @@ class TestAccount(AccountBase):
 def test_load_transaction_logs():
     account = TestAccount()
     account.load_transaction_logs(os.path.join(BASE_DIR, "multi"))
-    assert account.tr_log == 2
+    assert [row[0] for row in account.transaction_log.values()] == ["07", "08", "09", "10", "17", "18", "19", "20"]
+
+
+def test_load_transaction_logs_merge(tmpdir):
+    for name, ids in (("a.csv", [5, 1, 9]), ("b.txt", [2, 8]), ("c.csv", [7, 3, 4, 6]), ("d.json", [0])):
+        tmpdir.join(name).write("id,value\n" + "".join(f"{i},{name}\n" for i in ids))
+    rows = []
+
+    class MergeAccount(TestAccount):
+        def _parse(self, row):
+            rows.append(row)
+
+        def load_transaction_logs(self, directory):
+            self._load_transaction_logs(directory, "ASCII", ',', lambda i: int(i[0]))
+
+    MergeAccount().load_transaction_logs(str(tmpdir))
+    assert [int(row[0]) for row in rows] == list(range(1, 10))
 
 
 def test_load_csv_file():
@@ -57,3 +84,51 @@ def test_parse_transaction_log_warning_handler():
     account = TestAccount(handler)
     account._parse_transaction_log(data)
     assert str(message) == "666"
+
+
+def test_journal():
+    journal = Journal()
+    buy = TradeTransaction(datetime(2020, 1, 1), TransactionSide.BUY, "ABC", 10)
+    dividend = DividendTransaction(datetime(2020, 1, 2), "ABC", Decimal(1), "USD")
+    sell = TradeTransaction(datetime(2020, 1, 3), TransactionSide.SELL, "ABC", 10)
+    other = TradeTransaction(datetime(2020, 1, 3), TransactionSide.BUY, "XYZ", 1)
+    for t in (buy, dividend, sell, other):
+        journal.append(t)
+    assert journal == {"ABC": [buy, dividend, sell], "XYZ": [other]}
+    assert journal["ABC"][-1] is sell
+    assert journal.side("ABC", TransactionSide.BUY) == [buy]
+    assert journal.side("ABC", TransactionSide.SELL) == [sell]
+    assert journal.side("XYZ", TransactionSide.DIVIDEND) == []
+    assert journal.side("QQQ", TransactionSide.BUY) == []
+
+
+def test_sorted_rows(tmpdir):
+    ordered, unordered = tmpdir.join("ordered.csv"), tmpdir.join("unordered.csv")
+    ordered.write("id\n1\n2\n2\n3\n")
+    unordered.write("id\n3\n1\n2\n")
+    rows = AccountBase._sorted_rows(str(ordered), "ASCII", ',', lambda i: i[0])
+    assert not isinstance(rows, list), "ordered file should be streamed"
+    assert list(rows) == [["1"], ["2"], ["2"], ["3"]]
+    assert AccountBase._sorted_rows(str(unordered), "ASCII", ',', lambda i: i[0]) == [["1"], ["2"], ["3"]]
+    assert list(AccountBase._sorted_rows(str(unordered), "ASCII", ',')) == [["3"], ["1"], ["2"]]
+
+
+@pytest.mark.parametrize("encoding", ["utf=16", "utf-16-le", "utf-16-be", "ASCII"])
+def test_line_chunks(tmpdir, encoding):
+    # quoted fields with line breaks, also at field end and before doubled quote, are never split
+    comments = ["text\n", '""quoted"" start', 'multi\n""line""\n', "\n", "plain", 'end\n"""']
+    rows = [["id", "comment"]] + [[f"{i:04}", comments[i % len(comments)]] for i in range(600)]
+    file = str(tmpdir.join("log.csv"))
+    with open(file, "w", encoding=encoding, newline='') as f:
+        csv.writer(f, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(
+            [[field.replace('""', '"') for field in row] for row in rows])
+
+    codec, chunks = AccountBase._line_chunks(file, encoding, 40)
+    with open(file, "rb") as f:
+        data = f.read()
+    assert len(chunks) > 20
+    assert chunks[0][0] == (2 if encoding == "utf=16" else 0), "byte order mark should be skipped"
+    assert chunks[-1][1] == len(data)
+    assert all(end == begin for (_, end), (begin, _) in zip(chunks, chunks[1:])), "chunks should cover whole file"
+    parsed = [row for begin, end in chunks for row in csv.reader(io.StringIO(data[begin:end].decode(codec), newline=''), delimiter='\t')]
+    assert parsed == [[field.replace('""', '"') for field in row] for row in rows]
@@ -1,16 +1,22 @@
+import csv
 import os
-from datetime import datetime
+import random
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 import pytest
 
+from engine import exante
 from engine.exante import ExanteAccount
-from engine.transaction import TradeTransaction, TransactionSide, DividendTransaction
-from engine.utils import ParseError
+from engine.fifo import YearEndSnapshot
+from engine.journal import JournalCache
+from engine.results import ResultStore
+from engine.transaction import TradeTransaction, TransactionSide, DividendTransaction, CashFlowItemType
+from engine.utils import ExchangeRateNotFound, ParseError
 from tests import BASE_DIR
-from tests.setup import nbp, nbp_real, nbp_mock
+from tests.setup import nbp, nbp_real, nbp_mock, nbp_local, nbp_server, fake_rate_day_before
 
-_ = (nbp, nbp_real, nbp_mock,)
+_ = (nbp, nbp_real, nbp_mock, nbp_local, nbp_server,)
 del _
 
 
@@ -156,6 +162,58 @@ def test_load_transaction_logs(capfd):
     account = ExanteAccount(lambda e: print(e))
     account.load_transaction_logs(os.path.join(BASE_DIR, "multi"))
     assert len(account.transaction_log['XYZ']) == 2
+    assert [t.time for t in account.transaction_log['XYZ']] == [datetime(2020, 2, 1), datetime(2020, 1, 1)], "files should be merged by transaction id"
+
+
+def test_load_transaction_logs_overlapping(tmpdir):
+    for name in ("m1.csv", "m2.csv"):
+        with open(os.path.join(BASE_DIR, "multi", name), encoding="utf-16", newline='') as f:
+            tmpdir.join(name).write_text(f.read(), encoding="utf-16")
+    with open(os.path.join(BASE_DIR, "multi", "m1.csv"), encoding="utf-16", newline='') as f:
+        tmpdir.join("all.csv").write_text(f.read(), encoding="utf-16")
+    warnings = []
+    account = ExanteAccount(warnings.append)
+    account.load_transaction_logs(str(tmpdir))
+    assert len(account.transaction_log['XYZ']) == 2
+    assert "Skipped 4 duplicate transactions found in overlapping transaction logs." in warnings
+
+
+def test_load_transaction_log_journal_cache(tmpdir, monkeypatch):
+    file = tmpdir.join("exante.csv")
+    with open(os.path.join(BASE_DIR, "exante.csv"), "rb") as f:
+        file.write_binary(f.read())
+    cache = JournalCache(str(tmpdir.join("cache")))
+
+    def _load():
+        warnings = []
+        account = ExanteAccount(warnings.append, journal_cache=cache)
+        account.load_transaction_log(str(file))
+        return account, [str(w) for w in warnings]
+
+    parsed, warnings = _load()
+    assert "Unsupported transaction type AUTOCONVERSION." in warnings
+
+    def _parse_error(self, row):
+        raise AssertionError("snapshot should be used")
+
+    with monkeypatch.context() as m:
+        m.setattr(ExanteAccount, "_parse", _parse_error)
+        cached, cached_warnings = _load()
+    assert cached_warnings == warnings
+    assert {s: [t.fields() for t in tr] for s, tr in cached.transaction_log.items()} == {s: [t.fields() for t in tr] for s, tr in parsed.transaction_log.items()}
+    symbol = next(iter(cached.transaction_log))
+    assert cached.transaction_log.side(symbol, cached.transaction_log[symbol][0].side)[0] is cached.transaction_log[symbol][0]
+
+    parse = ExanteAccount._parse
+    calls = []
+    monkeypatch.setattr(ExanteAccount, "_parse", lambda self, row: calls.append(row) or parse(self, row))
+    os.utime(str(file), ns=(0, 0))
+    _load()
+    assert calls, "changed file should be parsed again"
+    calls.clear()
+    monkeypatch.setattr(ExanteAccount, "PARSER_VERSION", ExanteAccount.PARSER_VERSION + 1)
+    _load()
+    assert calls, "snapshot of previous parser version should not be used"
 
 
 def test_load_cash_flow_no_buy(nbp_mock):
@@ -216,6 +274,56 @@ def test_load_cash_flow_multi_year(nbp_mock):
     assert len(account.cash_flows[2021]['ABC']) == 4
 
 
+def test_load_cash_flow_rerun(nbp_mock):
+    account = ExanteAccount()
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-01 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-01 00:00:00", "1500", "USD", "", ""],
+        ["3", "", "ABC", "None", "COMMISSION", "2020-01-01 00:00:00", "-3.0", "USD", "", ""],
+        ["4", "", "ABC", "ISIN", "TRADE", "2020-01-01 00:00:00", "-50", "ABC", "", ""],
+        ["5", "", "ABC", "None", "TRADE", "2020-01-01 00:00:00", "500", "USD", "", ""],
+        ["6", "", "ABC", "None", "COMMISSION", "2020-01-01 00:00:00", "-1.0", "USD", "", ""],
+    ]
+    account._parse_transaction_log(data, lambda i: i[0])
+    account._load_cash_flow(nbp_mock)
+    first = [(cf.type, cf.count, cf.price) for cf in account.cash_flows[2020]['ABC']]
+    account._load_cash_flow(nbp_mock)
+    assert [(cf.type, cf.count, cf.price) for cf in account.cash_flows[2020]['ABC']] == first
+    assert first[3] == (CashFlowItemType.COMMISSION, -1, Decimal("1.00"))
+    buy, sell = account.transaction_log["ABC"]
+    assert (buy.count, buy.commission, sell.count) == (150, Decimal("3.0"), 50), "transactions should not be modified"
+
+
+def test_report_totals(exante_account, nbp_mock):
+    totals = exante_account._totals()
+    assert exante_account._totals() is totals, "totals should be computed once for all reports"
+    assert totals.value(2020, "ABC", CashFlowItemType.TRADE, 1) == Decimal("1000")
+    assert totals.pln(2020, type=CashFlowItemType.DIVIDEND) == Decimal("120.20")
+    assert totals.price(2021, "XYZ", CashFlowItemType.DIVIDEND) == 0
+    exante_account.init_cash_flow(nbp_mock)
+    assert exante_account._totals() is not totals, "recalculated cash flow should be aggregated again"
+
+
+def test_report_missing_price(nbp_mock):
+    account = ExanteAccount()
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-01 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-01 00:00:00", "1500", "USD", "", ""],
+        ["3", "", "ABC", "None", "COMMISSION", "2020-01-01 00:00:00", "-3.0", "USD", "", ""],
+        ["4", "", "ABC", "ISIN", "TRADE", "2020-02-01 00:00:00", "-50", "ABC", "", ""],
+        ["5", "", "ABC", "None", "TRADE", "2020-02-01 00:00:00", "1000", "USD", "", ""],
+        ["6", "", "QQQ", "None", "DIVIDEND", "2020-03-02 00:00:00", "60.10", "USD", "", ""],
+    ]
+    account._parse_transaction_log(data)
+    account.init_cash_flow(nbp_mock)
+    with pytest.raises(TypeError, match="Missing price of COMMISSION cash flow item of ABC in 2020."):
+        account.get_foreign()
+    with pytest.raises(TypeError, match="Missing price of TAX cash flow item of QQQ in 2020."):
+        account.get_dividends()
+    with pytest.raises(TypeError, match="Missing price of TAX cash flow item of QQQ in 2020."):
+        account.get_dividends_pln()
+
+
 def test_get_foreign(exante_account):
     t = exante_account.get_foreign()[1:]  # skip header
     assert len(t) == 4
@@ -328,3 +436,281 @@ def test_dividends_pln(exante_account):
     assert round(t[idx][2] / t[idx][1] * 100) == Decimal("4"), "%"
     assert round(t[idx][1] * Decimal("0.19"), 2) == Decimal("22.84"), "total to pay"
     assert round(round(t[idx][1] * Decimal("0.19"), 2) - t[idx][2]) == Decimal("18"), "left to pay"
+
+
+def test_init_cash_flow_prefetch(nbp_local, nbp_server):
+    account = ExanteAccount()
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "1500", "USD", "", ""],
+        ["3", "", "ABC", "None", "COMMISSION", "2020-01-07 00:00:00", "-3.0", "USD", "", ""],
+        ["4", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-150", "ABC", "", ""],
+        ["5", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "1500", "USD", "", ""],
+        ["6", "", "ABC", "None", "COMMISSION", "2020-02-03 00:00:00", "-3.0", "USD", "", ""],
+        ["7", "", "QQQ", "None", "DIVIDEND", "2020-03-02 00:00:00", "60.10", "USD", "", ""],
+        ["8", "", "QQQ", "None", "TAX", "2020-03-02 00:00:00", "-2.2", "USD", "", ""],
+    ]
+    account._parse_transaction_log(data)
+    account.init_cash_flow(nbp_local)
+    assert len(nbp_server.requests) == 1, "all rates should be fetched with single range query"
+    assert account.cash_flows[2020]["QQQ"][0].pln == fake_rate_day_before("USD", date(2020, 3, 2))
+
+
+def test_init_cash_flow_not_found(nbp_local, nbp_server):
+    account = ExanteAccount()
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "-1500", "xUSD", "", ""],
+        ["3", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-150", "ABC", "", ""],
+        ["4", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "1500", "xUSD", "", ""],
+    ]
+    account._parse_transaction_log(data)
+    with pytest.raises(ExchangeRateNotFound, match="xUSD: 2 dates from 2020-01-07 to 2020-02-03"):
+        account.init_cash_flow(nbp_local)
+
+
+def test_init_cash_flow_no_currency(nbp_local, nbp_server):
+    account = ExanteAccount()
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "-1500", "USD", "", ""],
+        ["3", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-150", "ABC", "", ""],  # no price row
+    ]
+    account._parse_transaction_log(data)
+    with pytest.raises(ExchangeRateNotFound, match="no currency: 2 dates from 2020-01-07 to 2020-02-03"):
+        account.init_cash_flow(nbp_local)
+    assert nbp_local.store.miss(None, date(2020, 2, 3)) is None
+
+
+def test_init_cash_flow_unused_rates(nbp_local, nbp_server):
+    # rates of open lots and of symbols without cash flow aren't looked up, NBP doesn't quote CNH
+    warnings = []
+    account = ExanteAccount(warnings.append)
+    data = [
+        ["1", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["2", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "-1500", "USD", "", ""],
+        ["3", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-150", "ABC", "", ""],
+        ["4", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "1800", "USD", "", ""],
+        ["5", "", "HK1", "ISIN", "TRADE", "2020-02-04 00:00:00", "100", "HK1", "", ""],
+        ["6", "", "HK1", "None", "TRADE", "2020-02-04 00:00:00", "-500", "CNH", "", ""],
+        ["7", "", "NOB", "ISIN", "TRADE", "2020-03-02 00:00:00", "-1", "NOB", "", ""],
+        ["8", "", "NOB", "None", "TRADE", "2020-03-02 00:00:00", "10", "CNH", "", ""],
+    ]
+    account._parse_transaction_log(data)
+    account.init_cash_flow(nbp_local)
+    assert list(account.cash_flows[2020]) == ["ABC"]
+    assert warnings == ["No BUY transactions for symbol: NOB."]
+    assert not nbp_local.failures
+
+
+def _numbered(rows):
+    # transaction log rows with ids in row order
+    return [[f"{i:02}"] + row[1:] for i, row in enumerate(rows)]
+
+
+def _flows(account):
+    # comparable cash flows of account {year: {symbol: [(type, time, count, price, currency, pln),...]}}
+    return {year: {symbol: [(cf.type, cf.time, cf.count, cf.price, cf.currency, cf.pln) for cf in cash_flow] for symbol, cash_flow in symbols.items()}
+            for year, symbols in account.cash_flows.items()}
+
+
+def test_load_cash_flow_jobs(nbp_local, nbp_server):
+    data = _numbered([
+        ["", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "1500", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-01-07 00:00:00", "-3.0", "USD", "", ""],
+        ["", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-50", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "1000", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-02-03 00:00:00", "-3.0", "USD", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2020-01-08 00:00:00", "10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2020-01-08 00:00:00", "100", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2020-01-08 00:00:00", "1", "EUR", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2021-02-01 00:00:00", "-10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2021-02-01 00:00:00", "100", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2021-02-01 00:00:00", "1", "EUR", "", ""],
+        ["", "", "QQQ", "None", "DIVIDEND", "2020-03-02 00:00:00", "60.10", "USD", "", ""],
+        ["", "", "QQQ", "None", "TAX", "2020-03-02 00:00:00", "-2.2", "USD", "", ""],
+        ["", "", "NOB", "ISIN", "TRADE", "2020-03-02 00:00:00", "-1", "NOB", "", ""],
+        ["", "", "NOB", "None", "TRADE", "2020-03-02 00:00:00", "10", "USD", "", ""],
+    ])
+
+    def _cash_flows(jobs):
+        warnings = []
+        account = ExanteAccount(warnings.append, jobs)
+        account._parse_transaction_log(data)
+        account.init_cash_flow(nbp_local)
+        return warnings, _flows(account)
+
+    serial = _cash_flows(1)
+    parallel = _cash_flows(3)
+    assert parallel == serial
+    assert list(parallel[1]) == [2020, 2021] and list(parallel[1][2020]) == ["ABC", "QQQ"]
+    assert parallel[0] == ["No BUY transactions for symbol: NOB."]
+
+
+def test_load_cash_flow_jobs_rate_dates(nbp_local, nbp_server, monkeypatch):
+    # workers get exactly the rates serial calculation looks up, rates of other currencies of symbol may be missing
+    data = _numbered([
+        ["", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "10", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "-100", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-01-07 00:00:00", "-1", "USD", "", ""],
+        ["", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-10", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "120", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-02-03 00:00:00", "-1", "USD", "", ""],
+        ["", "", "ABC", "None", "DIVIDEND", "2021-03-02 00:00:00", "6.10", "EUR", "", ""],
+        ["", "", "ABC", "None", "TAX", "2021-03-02 00:00:00", "-0.9", "EUR", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2020-01-08 00:00:00", "10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2020-01-08 00:00:00", "-100", "GBP", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2020-01-08 00:00:00", "-1", "GBP", "", ""],
+    ])
+    get_nbp_day_before = nbp_local.get_nbp_day_before
+
+    def _rate_dates(jobs):
+        account = ExanteAccount(None, jobs)
+        account._parse_transaction_log(data)
+        nbp_local.load_cache()
+        looked_up = set()
+
+        def _get(currency, time):
+            looked_up.add((currency, time.date()))
+            return get_nbp_day_before(currency, time)
+
+        monkeypatch.setattr(nbp_local, "get_nbp_day_before", _get)
+        account._load_cash_flow(nbp_local)
+        return looked_up
+
+    serial = _rate_dates(1)
+    assert _rate_dates(2) == serial
+    assert ("USD", date(2021, 3, 2)) not in serial and ("EUR", date(2020, 1, 7)) not in serial
+
+
+def test_year_end_snapshot(nbp_local, nbp_server, tmpdir):
+    data = _numbered([
+        ["", "", "ABC", "ISIN", "TRADE", "2019-03-01 00:00:00", "100", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2019-03-01 00:00:00", "-1000", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2019-03-01 00:00:00", "-3.0", "USD", "", ""],
+        ["", "", "ABC", "ISIN", "TRADE", "2019-06-03 00:00:00", "-30", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2019-06-03 00:00:00", "450", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2019-06-03 00:00:00", "-1.0", "USD", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2019-07-01 00:00:00", "10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2019-07-01 00:00:00", "-500", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2019-07-01 00:00:00", "-2.0", "EUR", "", ""],
+        ["", "", "QQQ", "None", "DIVIDEND", "2019-09-02 00:00:00", "60.10", "USD", "", ""],
+        ["", "", "QQQ", "None", "TAX", "2019-09-02 00:00:00", "-2.2", "USD", "", ""],
+        ["", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-50", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "900", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-02-03 00:00:00", "-1.5", "USD", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2020-03-02 00:00:00", "-10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2020-03-02 00:00:00", "600", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2020-03-02 00:00:00", "-2.0", "EUR", "", ""],
+    ])
+
+    full = ExanteAccount()
+    full._parse_transaction_log([list(row) for row in data])
+    full.init_cash_flow(nbp_local)
+    snapshot = full.year_end_snapshot(2019)
+    assert {symbol: [(lot.count, lot.commission) for lot in lots] for symbol, lots in snapshot.lots.items()} == \
+           {"ABC": [(70, Decimal("2.10"))], "XYZ": [(10, Decimal("2.0"))]}
+    assert list(snapshot.realized) == [2019]
+    snapshot.save(str(tmpdir.join("2019.snapshot")))
+
+    account = ExanteAccount(year_end=YearEndSnapshot.load(str(tmpdir.join("2019.snapshot"))))
+    account._parse_transaction_log([list(row) for row in data if row[5] >= "2020"])  # new year's log only
+    account.init_cash_flow(nbp_local)
+    assert _flows(account) == _flows(full)
+    assert {symbol: [lot.count for lot in lots] for symbol, lots in account.year_end_snapshot(2020).lots.items()} == {"ABC": [20]}
+
+    assert full.check_year_end(snapshot, nbp_local) == []
+    snapshot.lots["ABC"][0].count = 60
+    assert full.check_year_end(snapshot, nbp_local) == ["ABC: open lots at the end of 2019 differ.", "ABC: cash flow of 2020 differs."]
+
+
+def test_load_cash_flow_results(nbp_local, nbp_server, tmpdir, monkeypatch):
+    data = _numbered([
+        ["", "", "ABC", "ISIN", "TRADE", "2020-01-07 00:00:00", "150", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-01-07 00:00:00", "-1500", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-01-07 00:00:00", "-3.0", "USD", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2020-01-08 00:00:00", "10", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2020-01-08 00:00:00", "-100", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2020-01-08 00:00:00", "-1", "EUR", "", ""],
+        ["", "", "ABC", "ISIN", "TRADE", "2020-02-03 00:00:00", "-50", "ABC", "", ""],
+        ["", "", "ABC", "None", "TRADE", "2020-02-03 00:00:00", "1000", "USD", "", ""],
+        ["", "", "ABC", "None", "COMMISSION", "2020-02-03 00:00:00", "-3.0", "USD", "", ""],
+        ["", "", "NOB", "ISIN", "TRADE", "2020-03-02 00:00:00", "-1", "NOB", "", ""],
+        ["", "", "NOB", "None", "TRADE", "2020-03-02 00:00:00", "10", "USD", "", ""],
+        ["", "", "XYZ", "ISIN", "TRADE", "2021-02-01 00:00:00", "-4", "XYZ", "", ""],
+        ["", "", "XYZ", "None", "TRADE", "2021-02-01 00:00:00", "60", "EUR", "", ""],
+        ["", "", "XYZ", "None", "COMMISSION", "2021-02-01 00:00:00", "-1", "EUR", "", ""],
+    ])
+    calculated = []
+    calculate = exante._symbol_cash_flow
+    monkeypatch.setattr(exante, "_symbol_cash_flow", lambda sell, buy, *args: calculated.append((sell + buy)[0].symbol) or calculate(sell, buy, *args))
+    fingerprinted = []
+    fingerprint = ExanteAccount._fingerprint
+    monkeypatch.setattr(ExanteAccount, "_fingerprint", lambda self, symbol: fingerprinted.append(symbol) or fingerprint(self, symbol))
+
+    def _run(rows):
+        warnings = []
+        results = ResultStore(str(tmpdir.join("results")))
+        account = ExanteAccount(warnings.append, results=results)
+        account._parse_transaction_log([list(row) for row in rows])
+        account.init_cash_flow(nbp_local)
+        results.close()
+        return warnings, _flows(account)
+
+    first = _run(data[:11])
+    assert calculated == ["ABC", "XYZ", "NOB"]
+    assert fingerprinted == ["ABC", "XYZ", "NOB"], "fingerprints should be computed once per run"
+    calculated.clear()
+    assert _run(data[:11]) == first
+    assert calculated == []
+
+    warnings, cash_flows = _run(data)
+    assert calculated == ["XYZ"], "only symbol with new rows should be calculated"
+    assert warnings == first[0] == ["No BUY transactions for symbol: NOB."]
+    full = ExanteAccount()
+    full._parse_transaction_log([list(row) for row in data])
+    full.init_cash_flow(nbp_local)
+    assert cash_flows == _flows(full)
+
+
+def _generated_transaction_log(rows: int):
+    rnd = random.Random(rows)
+    data = []
+    for i in range(rows):
+        symbol = rnd.choice(["ABC", "XYZ", "QQQ"])
+        time = f"{date(2019, 2, 1) + timedelta(days=i // 4)} 00:00:00"
+        currency = rnd.choice(["USD", "EUR"])
+        count = rnd.randint(1, 300) * (1 if i % 3 else -1)
+        amount = Decimal(rnd.randint(1, 10 ** 6)) / (8 if i % 4 == 0 else 100)
+        data += [[f"{i}a", "", symbol, "ISIN", "TRADE", time, str(count), symbol, "", ""],
+                 [f"{i}b", "", symbol, "None", "TRADE", time, str(-amount if count > 0 else amount), currency, "", ""],
+                 [f"{i}c", "", symbol, "None", "COMMISSION", time, str(-Decimal(rnd.randint(1, 999)) / 100), currency, "", ""]]
+        if i % 5 == 0:
+            data += [[f"{i}d", "", symbol, "None", "DIVIDEND", time, str(amount / 7), currency, "", ""],
+                     [f"{i}e", "", symbol, "None", "TAX", time, str(-amount / 70), currency, "", ""]]
+    return data
+
+
+def test_load_transaction_log_parallel(tmpdir):
+    rows = _generated_transaction_log(1500)
+    rows += [["x1", "", "XYZ", "None", "AUTOCONVERSION", "2020-01-01 00:00:00", "1", "USD", "", ""],
+             ["x2", "", "", "None", "FUNDING/WITHDRAWAL", "2020-01-01 00:00:00", "100", "USD", "", ""]]
+    comments = ["multi\nline comment", "comment ending with line break\n", '"quoted"\n', "", ""]
+    rows = [row + [comments[i % len(comments)]] for i, row in enumerate(rows)]
+    random.Random(1).shuffle(rows)
+    file = str(tmpdir.join("exante.csv"))
+    with open(file, "w", encoding="utf-16", newline='') as f:
+        writer = csv.writer(f, delimiter='\t', quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow([f"Column {i}" for i in range(11)])
+        writer.writerows(rows)
+
+    def _load(jobs):
+        warnings = []
+        account = ExanteAccount(lambda e: warnings.append(str(e)), jobs)
+        account.load_transaction_log(file)
+        return {symbol: [t.fields() for t in transactions] for symbol, transactions in account.transaction_log.items()}, warnings
+
+    serial = _load(1)
+    assert _load(3) == serial
+    assert serial[1] == ["Unsupported transaction type AUTOCONVERSION."]
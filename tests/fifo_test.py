@@ -0,0 +1,39 @@
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from engine.fifo import match_fifo
+from engine.transaction import TradeTransaction, TransactionSide
+
+
+def _trade(day: int, side: TransactionSide, count: int, commission: str = "1.00"):
+    return TradeTransaction(datetime(2020, 1, 1) + timedelta(days=day), side, "ABC", count, Decimal(10), "USD", Decimal(commission))
+
+
+def test_match_fifo():
+    buys = [_trade(0, TransactionSide.BUY, 10, "3.00"), _trade(1, TransactionSide.BUY, 5)]
+    sells = [_trade(2, TransactionSide.SELL, 4), _trade(3, TransactionSide.SELL, 8), _trade(4, TransactionSide.SELL, 10)]
+    result = [(s, [(m.buy, m.count, m.commission, m.partial) for m in matches]) for s, matches in match_fifo(sells, buys)]
+    assert result == [
+        (sells[0], [(buys[0], 4, Decimal("1.20"), True)]),
+        (sells[1], [(buys[0], 6, Decimal("1.80"), False), (buys[1], 2, Decimal("0.40"), True)]),
+        (sells[2], [(buys[1], 3, Decimal("0.60"), False)]),  # 7 left unmatched
+    ]
+    assert [b.count for b in buys] == [10, 5] and [b.commission for b in buys] == [Decimal("3.00"), Decimal("1.00")]
+
+
+def test_match_fifo_linear():
+    buys = [_trade(0, TransactionSide.BUY, 1) for _ in range(50000)]
+    sells = [_trade(1, TransactionSide.SELL, 2) for _ in range(25000)]
+    assert sum(len(matches) for _, matches in match_fifo(sells, buys)) == 50000
+
+
+def test_match_fifo_open_lots():
+    buys = [_trade(0, TransactionSide.BUY, 10, "3.00"), _trade(1, TransactionSide.BUY, 5)]
+    lots = deque()
+    list(match_fifo([_trade(2, TransactionSide.SELL, 4)], buys, lots))
+    assert [(lot.buy, lot.count, lot.commission) for lot in lots] == [(buys[0], 6, Decimal("1.80")), (buys[1], 5, Decimal("1.00"))]
+    later = _trade(3, TransactionSide.BUY, 1)
+    result = [[(m.buy, m.count) for m in matches] for _, matches in match_fifo([_trade(4, TransactionSide.SELL, 12)], [later], lots)]
+    assert result == [[(buys[0], 6), (buys[1], 5), (later, 1)]]
+    assert not lots
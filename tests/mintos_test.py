@@ -4,12 +4,14 @@ from decimal import Decimal
 
 import pytest
 
+from engine import report
+from engine.journal import JournalCache
 from engine.mintos import MintosAccount
 from engine.transaction import DividendTransaction
 from tests import BASE_DIR
-from tests.setup import nbp, nbp_real, nbp_mock
+from tests.setup import nbp, nbp_real, nbp_mock, nbp_local, nbp_server
 
-_ = (nbp, nbp_real, nbp_mock,)
+_ = (nbp, nbp_real, nbp_mock, nbp_local, nbp_server,)
 del _
 
 
@@ -77,6 +79,18 @@ def test_load_transaction_log():
     assert len(account.transaction_log["Mintos"]) == 4
 
 
+def test_load_transaction_logs_overlapping(tmpdir):
+    with open(os.path.join(BASE_DIR, "mintos.csv")) as f:
+        lines = f.read().splitlines(keepends=True)
+    tmpdir.join("year.csv").write("".join(lines))
+    tmpdir.join("month.csv").write("".join(lines[:3]))
+    warnings = []
+    account = MintosAccount(warnings.append)
+    account.load_transaction_logs(str(tmpdir))
+    assert len(account.transaction_log["Mintos"]) == 4
+    assert warnings == ["Skipped 2 duplicate transactions found in overlapping transaction logs."]
+
+
 def test_load_cash_flow(nbp_mock):
     account = MintosAccount()
     data = [
@@ -103,3 +117,49 @@ def test_get_pln(mintos_account):
 
     assert round(t[0][0] * Decimal("0.19"), 2) == Decimal("7.60"), "total to pay"
     assert round(t[0][0] * Decimal("0.19"), 0) == Decimal("8"), "tax"
+
+
+def test_aggregate(nbp_local, nbp_server):
+    data = [[f"2020-03-{1 + i % 20:02} {i % 24:02}:00:00", str(i), "Loan - interest received", str(Decimal(i * 7919 % 100000) / 1000000 + Decimal("2.5E-5")), "",
+             ("EUR", "EUR", "GBP")[i % 3]] for i in range(3000)]
+
+    def _tables(aggregate):
+        account = MintosAccount(aggregate=aggregate)
+        account._parse_transaction_log([list(row) for row in data], lambda i: i[0])
+        account.init_cash_flow(nbp_local)
+        return account, account.get_foreign(), account.get_pln()
+
+    account, foreign, pln = _tables(True)
+    assert (foreign, pln) == _tables(False)[1:]
+    assert len(account.transaction_log) == 0
+    assert len(account.cash_flows["Mintos"]) == 40
+
+
+def test_load_transaction_log_journal_cache(tmpdir):
+    cache = JournalCache(str(tmpdir))
+    file = os.path.join(BASE_DIR, "mintos.csv")
+    for aggregate in (False, True, False, True):
+        account = MintosAccount(aggregate=aggregate, journal_cache=cache)
+        account.load_transaction_log(file)
+        assert len(account.transaction_log.get("Mintos", [])) == (0 if aggregate else 4)
+        assert len(account.totals) == (1 if aggregate else 0)
+
+
+@pytest.mark.parametrize("turnover", ["small", "large"])
+def test_arithmetic(turnover, nbp_local, nbp_server, monkeypatch):
+    # large turnover overflows int64 sums, so numpy arithmetic falls back to Decimal sums
+    scale = Decimal(1) if turnover == "small" else Decimal("1E+12")
+    data = [[f"2020-03-{1 + i % 20:02} {i % 24:02}:00:00", str(i), "Loan - interest received", str((Decimal(i * 7919 % 100000) / 1000000 + Decimal("2.5E-5")) * scale),
+             "", ("EUR", "EUR", "GBP")[i % 3]] for i in range(3000)]
+    data.append(["2020-03-01 00:00:00", "x", "Loan - late fees received", "-1.0", "", "EUR"])
+
+    def _tables(arithmetic):
+        account = MintosAccount(arithmetic=arithmetic)
+        account._parse_transaction_log([list(row) for row in data], lambda i: i[0])
+        account.init_cash_flow(nbp_local)
+        return repr((account.get_foreign(), account.get_pln()))
+
+    decimal = _tables("decimal")
+    assert _tables("numpy") == decimal
+    monkeypatch.setattr(report, "numpy", None)
+    assert _tables("numpy") == decimal
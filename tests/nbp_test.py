@@ -1,40 +1,307 @@
+import json
 import os
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 import pytest
+import requests
 
-from engine.NBP import NBP
+from engine.NBP import NBP, PublicationCalendar, polish_holidays, read_archive, _date_ranges, MAX_RANGE_DAYS
 from engine.utils import ExchangeRateNotFound
-from tests.setup import test_cache_file, nbp
+from tests import BASE_DIR
+from tests.setup import test_cache_file, test_cache_files, nbp, nbp_local, nbp_server, fake_rate_day_before, fake_is_publication_day
 
-_ = (nbp,)
+_ = (nbp, nbp_local, nbp_server,)
 del _
 
 
 def test_save_load_cache(nbp: NBP):
-    cache_key = "2000-01-05 GBP"
+    exchange_date = date(2000, 1, 4)
     cache_value = 7.77
     cache_decimal_value = round(Decimal(cache_value), 4)
-    assert len(nbp.cache) == 0, "Should be empty"
-
-    nbp.cache = {cache_key: cache_value}
+    assert len(nbp.published) == 0, "Should be empty"
 
+    nbp.store.upsert(exchange_date, {"GBP": cache_decimal_value}, True)
     nbp.save_cache()
-    nbp.cache = None
+    nbp.close()
+
+    nbp = NBP(test_cache_file)
     nbp.load_cache()
-    assert nbp.cache, "Should be not empty"
-    assert nbp.cache.get(cache_key) == cache_decimal_value, f"value {cache_decimal_value} should be in cache under {cache_key}"
+    assert len(nbp.published) == 0, "Should be loaded lazily"
     assert os.path.exists(test_cache_file), "cache should be on disk"
-    assert nbp.get_nbp_day_before(cache_key.split(' ')[1], datetime.fromisoformat(cache_key.split(' ')[0])) == cache_decimal_value, "Should get from cache"
+    assert nbp.get_nbp_day_before("GBP", datetime.fromisoformat("2000-01-05")) == cache_decimal_value, "Should get from cache"
+    assert nbp.published == {exchange_date: {"GBP": cache_decimal_value}}
+    with pytest.raises(ExchangeRateNotFound):
+        nbp.get_nbp_day_before("USD", datetime.fromisoformat("2000-01-05"))  # complete table without USD
+    nbp.close()
+
+
+def test_store(nbp: NBP):
+    store = nbp.store
+    store.upsert(date(2021, 4, 1), {"USD": Decimal("3.8986"), "EUR": Decimal("4.6597")}, True)
+    store.upsert(date(2021, 4, 2), {"USD": Decimal("3.9")})
+    store.upsert(date(2021, 4, 2), {"USD": Decimal("3.9012")})
+    assert store.rate("USD", date(2021, 4, 2)) == Decimal("3.9012")
+    assert store.rate("EUR", date(2021, 4, 2)) is None
+    assert store.rates("USD", date(2021, 3, 1), date(2021, 4, 1)) == {date(2021, 4, 1): Decimal("3.8986")}
+    assert store.day(date(2021, 4, 1)) == ({"USD": Decimal("3.8986"), "EUR": Decimal("4.6597")}, True)
+    assert store.day(date(2021, 4, 2)) == ({"USD": Decimal("3.9012")}, False)
+
+    store.mark([date(2021, 4, 3)], True)
+    store.mark([date(2021, 4, 2), date(2021, 4, 1)], False)
+    store.mark([date(2021, 4, 1)], None)
+    assert store.calendar() == ({date(2021, 4, 3)}, {date(2021, 4, 2)})
+
+
+def test_store_shared(nbp: NBP):
+    other = NBP(test_cache_file)
+    nbp.store.upsert(date(2021, 4, 1), {"USD": Decimal("3.8986")})
+    nbp.save_cache()
+    assert other.store.rate("USD", date(2021, 4, 1)) == Decimal("3.8986"), "other process should see committed rates"
+    other.store.upsert(date(2021, 4, 1), {"EUR": Decimal("4.6597")}, True)
+    other.save_cache()
+    other.close()
+    assert nbp.store.day(date(2021, 4, 1)) == ({"USD": Decimal("3.8986"), "EUR": Decimal("4.6597")}, True)
+
+
+def test_load_cache_migration(nbp: NBP):
+    with open(test_cache_file, "w") as f:
+        json.dump({"2021-04-03 USD": 3.8986, "2021-04-04 USD": 3.8986, "2021-04-06 USD": 3.8986, "2021-04-06 EUR": 4.6597}, f)
+
+    nbp.load_cache()
+    assert nbp.store.day(date(2021, 4, 2)) == ({"USD": Decimal("3.8986"), "EUR": Decimal("4.6597")}, False), "weekend and Easter Monday resolve to Friday"
+    assert nbp.get_nbp_day_before("USD", datetime.fromisoformat("2021-04-05")) == Decimal("3.8986"), "Should be shared by whole weekend"
+    assert os.path.exists(f"{test_cache_file}.json"), "JSON cache should be kept as backup"
 
 
 def test_get_nbp_day_before(nbp: NBP):
     assert nbp.get_nbp_day_before("USD", datetime.fromisoformat("2021-04-04")) == Decimal("3.8986"), "Should be Decimal(3.8986)"
-    assert nbp.cache.get("2021-04-04 USD") == Decimal("3.8986"), "Should be Decimal(3.8986) from cache"
+    assert nbp.store.rate("USD", nbp.calendar.day_before(date(2021, 4, 4))) == Decimal("3.8986"), "Should be Decimal(3.8986) from cache"
 
 
 def test_exchange_rate_not_found(nbp: NBP):
     with pytest.raises(ExchangeRateNotFound):
         nbp.get_nbp_day_before("xUSD", datetime.fromisoformat("2021-04-04"))
 
+
+def test_date_ranges():
+    dates = [date(2020, 1, 20), date(2020, 1, 15), date(2020, 6, 1)]
+    assert list(_date_ranges(dates)) == [(date(2020, 1, 15), date(2020, 1, 20)), (date(2020, 6, 1), date(2020, 6, 1))]
+    ranges = list(_date_ranges(date(2020, 1, 1) + timedelta(days=i) for i in range(366)))
+    assert all((end - start).days < MAX_RANGE_DAYS for start, end in ranges)
+    assert len(ranges) == 4
+
+
+def test_prefetch(nbp_local: NBP, nbp_server):
+    dates = [datetime(2021, 4, d, 12) for d in range(1, 11)]  # Easter Monday 2021-04-05
+    nbp_local.prefetch([("USD", d) for d in dates] + [("EUR", d) for d in dates])
+    requests = 1 if nbp_local.table_mode else 2  # one range query for all currencies or per currency
+    assert len(nbp_server.requests) == requests
+
+    for d in dates:
+        assert nbp_local.get_nbp_day_before("USD", d) == fake_rate_day_before("USD", d.date())
+        assert nbp_local.get_nbp_day_before("EUR", d) == fake_rate_day_before("EUR", d.date())
+    assert len(nbp_server.requests) == requests, "all rates should be served from cache"
+
+
+def test_get_nbp_day_before_local(nbp_local: NBP, nbp_server):
+    monday = datetime(2021, 4, 6)  # day after Easter Monday
+    assert nbp_local.get_nbp_day_before("USD", monday) == fake_rate_day_before("USD", monday.date())
+    assert len(nbp_server.requests) == 1, "holidays and weekends should be skipped"
+    assert nbp_server.requests[0].endswith("2021-04-02"), "should step back to Friday"
+    assert nbp_local.get_nbp_day_before("EUR", monday) == fake_rate_day_before("EUR", monday.date())
+    if nbp_local.table_mode:
+        assert len(nbp_server.requests) == 1, "table should already have all currencies"
+
+
+def test_get_nbp_day_before_unpublished(nbp_local: NBP, nbp_server):
+    nbp_local.calendar.mark(date(2021, 4, 3), True)  # wrong correction, e.g. from outdated calendar
+    saturday = datetime(2021, 4, 4)
+    assert nbp_local.get_nbp_day_before("USD", saturday) == fake_rate_day_before("USD", saturday.date())
+    if nbp_local.table_mode:
+        assert nbp_server.requests == ["/api/exchangerates/tables/a/2021-04-03", "/api/exchangerates/tables/a/2021-04-02"]
+        assert not nbp_local.calendar.is_publication_day(date(2021, 4, 3)), "404 should correct calendar"
+
+
+def test_prefetch_not_found(nbp_local: NBP, nbp_server):
+    nbp_local.prefetch([("xUSD", datetime(2021, 4, 4))])
+    assert all("xUSD" not in rates for rates in nbp_local.published.values())
+    with pytest.raises(ExchangeRateNotFound):
+        nbp_local.get_nbp_day_before("xUSD", datetime(2021, 4, 4))
+
+
+def test_negative_cache(nbp_local: NBP, nbp_server):
+    with pytest.raises(ExchangeRateNotFound, match="xUSD"):
+        nbp_local.get_nbp_day_before("xUSD", datetime(2021, 4, 4))
+    requests = len(nbp_server.requests)
+    with pytest.raises(ExchangeRateNotFound, match="xUSD"):
+        nbp_local.get_nbp_day_before("xUSD", datetime(2021, 4, 4))
+    assert len(nbp_server.requests) == requests, "failure should be memoized in this run"
+
+    nbp = NBP(test_cache_file, nbp_server.url, tables=nbp_local.table_mode)
+    with pytest.raises(ExchangeRateNotFound, match="xUSD"):
+        nbp.get_nbp_day_before("xUSD", datetime(2021, 4, 4))
+    assert len(nbp_server.requests) == requests, "failure should be cached in store"
+    assert nbp.get_nbp_day_before("USD", datetime(2021, 4, 4)) == fake_rate_day_before("USD", date(2021, 4, 4))
+    nbp.close()
+
+    nbp = NBP(test_cache_file, nbp_server.url, tables=nbp_local.table_mode, negative_ttl=0)
+    nbp.store.add_miss("USD", date(2021, 4, 14), "expired", 0)
+    assert nbp.get_nbp_day_before("USD", datetime(2021, 4, 14)) == fake_rate_day_before("USD", date(2021, 4, 14))
+    with pytest.raises(ExchangeRateNotFound, match="xUSD"):
+        nbp.get_nbp_day_before("xUSD", datetime(2021, 4, 4))
+    assert len(nbp_server.requests) > requests, "expired failure should be looked up again"
+    nbp.close()
+
+
+def test_failure_report(nbp_local: NBP, nbp_server):
+    nbp_local.prefetch([("xUSD", datetime(2021, 4, 4)), ("xUSD", datetime(2021, 5, 4)), ("xEUR", datetime(2021, 4, 4)),
+                        ("USD", datetime(2021, 4, 4)), ("USD", datetime(1990, 4, 4))])
+    assert set(nbp_local.failures) == {("xUSD", date(2021, 4, 4)), ("xUSD", date(2021, 5, 4)), ("xEUR", date(2021, 4, 4)), ("USD", date(1990, 4, 4))}
+    report = nbp_local.failure_report().splitlines()
+    assert report[0] == "NBP exchange rate not found for 4 transaction dates:"
+    assert report[1].startswith("  USD: 1 dates from 1990-04-04 to 1990-04-04")
+    assert report[3].startswith("  xUSD: 2 dates from 2021-04-04 to 2021-05-04")
+
+
+def test_currency_no_longer_quoted(nbp_local: NBP, nbp_server):
+    # RUB is quoted until 2021-03-10, later tables are still published for other currencies
+    nbp_local.prefetch([("RUB", datetime(2021, 3, d)) for d in range(1, 26)])
+    assert all(nbp_local.calendar.is_publication_day(date(2021, 3, d)) for d in range(11, 25) if fake_is_publication_day(date(2021, 3, d)))
+    assert nbp_local.store.calendar() == (set(), set()), "missing days of one currency shouldn't be stored as not published"
+    assert nbp_local.get_nbp_day_before("USD", datetime(2021, 3, 17)) == fake_rate_day_before("USD", date(2021, 3, 17))
+    assert nbp_local.get_nbp_day_before("RUB", datetime(2021, 3, 11)) == fake_rate_day_before("RUB", date(2021, 3, 11))
+    with pytest.raises(ExchangeRateNotFound, match="RUB"):
+        nbp_local.get_nbp_day_before("RUB", datetime(2021, 3, 25))
+    assert ("RUB", date(2021, 3, 25)) in nbp_local.failures
+
+
+def test_polish_holidays():
+    assert polish_holidays(2021) == {date(2021, 1, 1), date(2021, 1, 6), date(2021, 4, 4), date(2021, 4, 5), date(2021, 5, 1), date(2021, 5, 3),
+                                     date(2021, 5, 23), date(2021, 6, 3), date(2021, 8, 15), date(2021, 11, 1), date(2021, 11, 11),
+                                     date(2021, 12, 25), date(2021, 12, 26)}
+    assert date(2010, 1, 6) not in polish_holidays(2010)
+    assert date(2025, 12, 24) in polish_holidays(2025)
+
+
+def test_calendar_day_before():
+    calendar = PublicationCalendar()
+    assert calendar.day_before(date(2021, 4, 6)) == date(2021, 4, 2), "Easter Monday and weekend"
+    assert calendar.day_before(date(2021, 4, 2)) == date(2021, 4, 1)
+    assert calendar.day_before(date(2021, 1, 4)) == date(2020, 12, 31), "previous year"
+    assert calendar.day_before(date(2021, 1, 1)) == date(2020, 12, 31)
+
+
+def test_calendar_mark_load():
+    calendar = PublicationCalendar()
+    assert calendar.mark(date(2021, 4, 2), False)
+    assert calendar.mark(date(2021, 4, 3), True)
+    assert not calendar.mark(date(2021, 4, 1), True), "already known"
+    assert calendar.day_before(date(2021, 4, 3)) == date(2021, 4, 1)
+    assert calendar.day_before(date(2021, 4, 6)) == date(2021, 4, 3)
+    assert [calendar.corrections(date(2021, 4, d)) for d in (1, 2, 3)] == [None, False, True]
+
+    loaded = PublicationCalendar()
+    loaded.load(calendar.published, calendar.unpublished)
+    assert loaded.published == {date(2021, 4, 3)}
+    assert loaded.unpublished == {date(2021, 4, 2)}
+    assert loaded.day_before(date(2021, 4, 6)) == date(2021, 4, 3)
+
+
+def test_prefetch_interrupted(nbp_local: NBP, nbp_server, monkeypatch):
+    dates = [("USD", datetime(2020, 2, 3)), ("USD", datetime(2020, 8, 3)), ("USD", datetime(2021, 2, 3))]  # 3 ranges
+    get = nbp_local.session.get
+
+    def interrupted_get(url, *args, **kwargs):
+        if len(nbp_server.requests) == 2:
+            raise KeyboardInterrupt
+        return get(url, *args, **kwargs)
+
+    nbp_local.workers = 1
+    monkeypatch.setattr(nbp_local.session, "get", interrupted_get)
+    with pytest.raises(KeyboardInterrupt):
+        nbp_local.prefetch(dates)
+
+    resumed = NBP(test_cache_file, nbp_local.api_url, nbp_local.table_mode)
+    resumed.load_cache()
+    resumed.prefetch(dates)
+    assert len(nbp_server.requests) == 3, "fetched rates should be checkpointed"
+    assert resumed.get_nbp_day_before("USD", datetime(2020, 8, 3)) == fake_rate_day_before("USD", date(2020, 8, 3))
+    resumed.close()
+
+
+def test_prefetch_concurrent(nbp_local: NBP, nbp_server):
+    nbp_server.delay = 0.05
+    dates = [("USD", datetime(year, month, 3)) for year in (2019, 2020, 2021, 2022) for month in (2, 6, 10)]  # 12 ranges
+    nbp_local.prefetch(dates)
+    assert len(nbp_server.requests) == 12
+    assert 1 < nbp_server.max_concurrency <= nbp_local.workers
+    for currency, d in dates:
+        assert nbp_local.get_nbp_day_before(currency, d) == fake_rate_day_before(currency, d.date())
+    assert len(nbp_server.requests) == 12
+
+
+def test_keep_alive(nbp_local: NBP, nbp_server):
+    for day in range(5, 10):
+        nbp_local.get_nbp_day_before("USD", datetime(2021, 7, day))
+    assert len(nbp_server.requests) == 5
+    assert len(nbp_server.connections) == 1, "connection should be reused"
+
+
+def test_retry(nbp_server):
+    nbp_server.failures = [503, 429, 502]
+    nbp = NBP(test_cache_file, nbp_server.url, backoff=0)
+    try:
+        nbp.prefetch([("USD", datetime(2021, 7, 5))])
+        assert not nbp_server.failures, "should retry after 503, 429 and 502"
+        assert len(nbp_server.requests) == 1
+        assert nbp.get_nbp_day_before("USD", datetime(2021, 7, 5)) == fake_rate_day_before("USD", date(2021, 7, 5))
+    finally:
+        nbp.close()
+        for file in test_cache_files:
+            if os.path.exists(file):
+                os.remove(file)
+
+
+@pytest.mark.parametrize("tables", [True, False], ids=["tables", "rates"])
+def test_retry_exhausted(nbp_server, tables):
+    nbp_server.failures = [503, 503]
+    nbp = NBP(test_cache_file, nbp_server.url, tables=tables, retries=1, backoff=0)
+    try:
+        with pytest.raises(requests.HTTPError):
+            nbp.get_nbp_day_before("USD", datetime(2021, 7, 5))
+        assert not nbp_server.requests, "earlier day should not be used when D-1 table can't be fetched"
+        assert nbp.get_nbp_day_before("USD", datetime(2021, 7, 5)) == fake_rate_day_before("USD", date(2021, 7, 5))
+    finally:
+        nbp.close()
+        for file in test_cache_files:
+            if os.path.exists(file):
+                os.remove(file)
+
+
+def test_read_archive():
+    rates = list(read_archive(os.path.join(BASE_DIR, "archiwum_tab_a_2021.csv")))
+    assert [day for day, _ in rates] == [date(2021, 4, 1), date(2021, 4, 2), date(2021, 4, 6), date(2021, 4, 7)]
+    assert rates[0][1] == {"THB": Decimal("0.1246"), "USD": Decimal("3.8986"), "EUR": Decimal("4.58"), "HUF": Decimal("0.0127"),
+                           "CHF": Decimal("4.1395"), "GBP": Decimal("5.3784"), "JPY": Decimal("0.0352")}
+
+
+def test_import_archive(nbp_local: NBP, nbp_server):
+    assert nbp_local.import_archive(os.path.join(BASE_DIR, "archiwum_tab_a_2021.csv")) == (4, 7)
+    nbp_local.load_cache()
+    assert nbp_local.get_nbp_day_before("USD", datetime(2021, 4, 6)) == Decimal("3.8873"), "Easter Monday should be skipped"
+    assert nbp_local.get_nbp_day_before("JPY", datetime(2021, 4, 7)) == Decimal("0.0351")
+    with pytest.raises(ExchangeRateNotFound):
+        nbp_local.get_nbp_day_before("xUSD", datetime(2021, 4, 7))
+    assert len(nbp_server.requests) == 0, "all rates should be served from imported archive"
+
+
+def test_prefetch_year(nbp_local: NBP, nbp_server):
+    coverage = nbp_local.prefetch_year(2021, ["USD", "EUR", "xUSD"])
+    days = len([d for d in range(365) if fake_is_publication_day(date(2021, 1, 1) + timedelta(days=d))])
+    assert coverage == [[2021, "USD", days, days, 0], [2021, "EUR", days, days, 0], [2021, "xUSD", days, 0, days]]
+    assert len(nbp_server.requests) == (4 if nbp_local.table_mode else 3 * 4), "4 ranges of 93 days"
+
+    requests = len(nbp_server.requests)
+    assert nbp_local.prefetch_year(2021, ["USD", "EUR"]) == coverage[:2]
+    assert len(nbp_server.requests) == requests, "should be served from cache"
@@ -0,0 +1,30 @@
+import random
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from engine.report import sum_columns
+from engine.transaction import CashFlowColumns, CashFlowItemType
+
+
+@pytest.mark.parametrize("pln", [False, True])
+def test_sum_columns(pln, monkeypatch):
+    pytest.importorskip("numpy")
+    rnd = random.Random(1)
+    columns = CashFlowColumns()
+    for i in range(1000):
+        columns.append(CashFlowItemType.DIVIDEND if i % 5 else CashFlowItemType.TAX, datetime(2020, 1, 1), 1,
+                       Decimal(rnd.randint(-99, 99999)) / (10 ** rnd.randint(0, 6)), "EUR", Decimal(rnd.randint(30000, 50000)) / 10000 if i % 7 else 2)
+    expected = [repr(columns.sum_price_pln(t) if pln else columns.sum_price(t)) for t in CashFlowItemType]
+
+    def _decimal_sum(self, type):
+        raise AssertionError("sum should be computed in numpy arrays")
+
+    monkeypatch.setattr(CashFlowColumns, "sum_price", _decimal_sum)
+    monkeypatch.setattr(CashFlowColumns, "sum_price_pln", _decimal_sum)
+    assert [repr(sum_columns(columns, t, pln)) for t in CashFlowItemType] == expected
+
+    columns.append(CashFlowItemType.DIVIDEND, datetime(2020, 1, 1), 1, Decimal("1E+20"), "EUR", Decimal("4.1234"))
+    with pytest.raises(AssertionError, match="numpy arrays"):
+        sum_columns(columns, CashFlowItemType.DIVIDEND, pln)  # int64 could overflow, Decimal sum is used
@@ -1,5 +1,11 @@
+import json
 import os
-from datetime import datetime
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
@@ -7,15 +13,150 @@ from engine.NBP import NBP
 from tests import BASE_DIR
 
 test_cache_file = os.path.join(BASE_DIR, ".test_cache")
+test_cache_files = tuple(test_cache_file + suffix for suffix in ("", "-wal", "-shm", ".json"))
+
+# fake NBP table A data
+FAKE_CURRENCIES = {"USD": Decimal("3.8"), "EUR": Decimal("4.3"), "GBP": Decimal("5.0"), "CHF": Decimal("4.1")}
+FAKE_LAST_QUOTES = {"RUB": date(2021, 3, 10)}  # currencies no longer quoted in table A after given day
+FAKE_FIRST_DAY = date(2019, 1, 1)
+FAKE_LAST_DAY = date(2022, 12, 31)
+FAKE_HOLIDAYS = {date(2019, 1, 1), date(2019, 4, 22), date(2019, 5, 1), date(2019, 5, 3), date(2019, 6, 20), date(2019, 8, 15), date(2019, 11, 1),
+                 date(2019, 11, 11), date(2019, 12, 25), date(2019, 12, 26),
+                 date(2020, 1, 1), date(2020, 1, 6), date(2020, 4, 13), date(2020, 5, 1), date(2020, 6, 11), date(2020, 11, 11), date(2020, 12, 25),
+                 date(2021, 1, 1), date(2021, 1, 6), date(2021, 4, 5), date(2021, 5, 3), date(2021, 6, 3), date(2021, 11, 1), date(2021, 11, 11),
+                 date(2022, 1, 6), date(2022, 4, 18), date(2022, 5, 3), date(2022, 6, 16), date(2022, 8, 15), date(2022, 11, 1), date(2022, 11, 11),
+                 date(2022, 12, 26)}  # weekday ones only
+
+
+def fake_is_publication_day(day: date):
+    return FAKE_FIRST_DAY <= day <= FAKE_LAST_DAY and day.weekday() < 5 and day not in FAKE_HOLIDAYS
+
+
+def fake_is_quoted(currency: str, day: date):
+    return currency in FAKE_CURRENCIES or day <= FAKE_LAST_QUOTES.get(currency, FAKE_FIRST_DAY - timedelta(days=1))
+
+
+def fake_rate(currency: str, day: date):
+    return FAKE_CURRENCIES.get(currency, Decimal("0.05")) + Decimal(day.toordinal() % 97) / 10000
+
+
+def fake_rate_day_before(currency: str, day: date):
+    day -= timedelta(days=1)
+    while not fake_is_publication_day(day):
+        day -= timedelta(days=1)
+    return fake_rate(currency, day)
+
+
+class FakeNBPServer(ThreadingHTTPServer):
+    """Local stand-in for NBP exchange rates API, serving FAKE_CURRENCIES table A rates."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FakeNBPHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/api"
+        self.requests = []
+        self.connections = set()  # client addresses
+        self.failures = []  # status codes returned before serving data
+        self.delay = 0  # response time [s]
+        self.concurrency = self.max_concurrency = 0
+        self.lock = threading.Lock()
+
+
+class _FakeNBPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    rates = re.compile(r"/api/exchangerates/rates/a/(\w+)/([\d-]+)(?:/([\d-]+))?/?$")
+    tables = re.compile(r"/api/exchangerates/tables/a/([\d-]+)(?:/([\d-]+))?/?$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8" if status == 200 else "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            if server.failures:
+                return self._send(server.failures.pop(0), "Service unavailable")
+            server.requests.append(self.path.split("?")[0])
+            server.concurrency += 1
+            server.max_concurrency = max(server.max_concurrency, server.concurrency)
+        try:
+            time.sleep(server.delay)
+            self._get(self.path.split("?")[0])
+        finally:
+            with server.lock:
+                server.concurrency -= 1
+
+    def _get(self, path: str):
+
+        match = self.rates.match(path)
+        if match:
+            currency, start, end = match.group(1).upper(), match.group(2), match.group(3)
+        else:
+            match = self.tables.match(path)
+            if not match:
+                return self._send(400, "400 BadRequest - Błędny zakres dat / Invalid date range")
+            currency, start, end = None, match.group(1), match.group(2)
+
+        start = date.fromisoformat(start)
+        end = date.fromisoformat(end) if end else start
+        if (end - start).days >= 93:
+            return self._send(400, "400 BadRequest - Przekroczony limit 93 dni / Limit of 93 days has been exceeded")
+
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        days = [d for d in days if fake_is_publication_day(d)]
+        if currency:
+            days = [d for d in days if fake_is_quoted(currency, d)]
+        if not days:
+            return self._send(404, "404 NotFound - Not Found - Brak danych")
+
+        if currency:
+            rates = [{"no": f"{d:%j}/A/NBP/{d.year}", "effectiveDate": str(d), "mid": float(fake_rate(currency, d))} for d in days]
+            return self._send(200, json.dumps({"table": "A", "currency": currency, "code": currency, "rates": rates}))
+
+        tables = [{"table": "A", "no": f"{d:%j}/A/NBP/{d.year}", "effectiveDate": str(d),
+                   "rates": [{"currency": c, "code": c, "mid": float(fake_rate(c, d))} for c in [*FAKE_CURRENCIES, *FAKE_LAST_QUOTES] if fake_is_quoted(c, d)]} for d in days]
+        self._send(200, json.dumps(tables))
+
+
+def _remove_cache_files():
+    for file in test_cache_files:
+        if os.path.exists(file):
+            os.remove(file)
+
 
 @pytest.fixture
 def nbp():
-    if os.path.exists(test_cache_file):
-        os.remove(test_cache_file)
-    yield NBP(test_cache_file)
-    # clean up
-    if os.path.exists(test_cache_file):
-        os.remove(test_cache_file)
+    _remove_cache_files()
+    nbp = NBP(test_cache_file)
+    yield nbp
+    nbp.close()
+    _remove_cache_files()  # clean up
+
+
+@pytest.fixture
+def nbp_server():
+    server = FakeNBPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=[True, False], ids=["tables", "rates"])
+def nbp_local(nbp_server, request):
+    _remove_cache_files()
+    nbp = NBP(test_cache_file, nbp_server.url, tables=request.param)
+    yield nbp
+    nbp.close()
+    _remove_cache_files()  # clean up
 
 
 @pytest.fixture
@@ -29,6 +170,9 @@ def nbp_mock():
         def load_cache(self):
             pass
 
+        def prefetch(self, dates):
+            pass
+
         def get_nbp_day_before(self, currency: str, date: datetime):
             return 2
 
@@ -36,5 +180,3 @@ def nbp_mock():
             pass
 
     return _MockNBP()
-
-
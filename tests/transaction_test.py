@@ -0,0 +1,34 @@
+import pickle
+from datetime import datetime
+from decimal import Decimal
+
+from engine.transaction import CashFlowColumns, CashFlowItemType, DividendTransaction, TradeTransaction, TransactionSide
+
+
+def test_fields():
+    trade = TradeTransaction(datetime(2020, 1, 1), TransactionSide.BUY, "ABC", 10, Decimal("1.5"), "USD", Decimal("1"))
+    assert list(trade.fields()) == ["time", "side", "symbol", "price", "currency", "count", "commission"]
+    assert DividendTransaction(datetime(2020, 1, 1), "ABC", Decimal("1.5"), "USD").fields()["tax"] is None
+
+
+def test_cash_flow_columns():
+    items = [(CashFlowItemType.DIVIDEND, datetime(2020, 1, 1, 12, 30, 15, 7), 1, Decimal("1.0"), "EUR", Decimal("4.2571")),
+             (CashFlowItemType.DIVIDEND, datetime(2020, 1, 2), 1, Decimal("1.00"), "EUR", Decimal("4.2571")),
+             (CashFlowItemType.TAX, datetime(2020, 1, 2), -1, Decimal("0.15"), "USD", 2),
+             (CashFlowItemType.DIVIDEND, datetime(2020, 1, 3), 1, Decimal("1.0"), "EUR", Decimal("2"))]
+    columns = CashFlowColumns()
+    for item in items:
+        columns.append(*item)
+
+    assert len(columns) == 4
+    assert [(cf.type, cf.time, cf.count, cf.price, cf.currency, cf.pln) for cf in columns] == items
+    assert [repr(cf.price) for cf in columns] == ["Decimal('1.0')", "Decimal('1.00')", "Decimal('0.15')", "Decimal('1.0')"], "equal values of different exponent are kept"
+    assert [repr(cf.pln) for cf in columns][2:] == ["2", "Decimal('2')"]
+    assert len(columns.price_values.values) == 3 and len(columns.currency_values.values) == 2
+
+    assert repr(columns.sum_price(CashFlowItemType.DIVIDEND)) == repr(sum(cf.price for cf in columns if cf.type == CashFlowItemType.DIVIDEND))
+    assert repr(columns.sum_price_pln(CashFlowItemType.DIVIDEND)) == repr(sum(cf.price * cf.pln for cf in columns if cf.type == CashFlowItemType.DIVIDEND))
+
+    restored = pickle.loads(pickle.dumps(columns))
+    restored.append(*items[0])
+    assert len(restored.price_values.values) == 3, "interned values should be found after unpickling"